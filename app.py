@@ -1,6 +1,10 @@
 import streamlit as st
 from components.auth_ui import auth_page, initialize_session_state
 from components.visualizer import twod_visualizer
+from components.scanner import prescription_scanner
+from components.dashboard import health_dashboard
+from database.schema import ensure_schema
+import metrics
 
 
 st.set_page_config(
@@ -9,6 +13,8 @@ st.set_page_config(
     layout="wide"
 )
 
+ensure_schema() # Once per process, Streamlit reruns skip it
+metrics.startServer() # /metrics on METRICS_PORT when METRICS_ENABLED=1
 initialize_session_state()
 
 st.sidebar.title("💊 Health Lens")
@@ -29,7 +35,7 @@ app_mode = st.sidebar.selectbox(
 
 if app_mode == "Prescription Scanner":
     st.title("Prescription Scanner")
-    st.write("This feature will be implemented next...")
+    prescription_scanner()
 
 elif app_mode == "Drug Effect Visualizer":
     st.title("Drug Effect Visualizer")
@@ -43,4 +49,4 @@ elif app_mode == "Medical Term Translator":
 
 elif app_mode == "Health Dashboard":
     st.title("Health Dashboard")
-    st.write("This feature will be implemented next...")
+    health_dashboard()
@@ -1,26 +1,34 @@
+import logging
 from datetime import datetime
-import bcrypt
+from pymongo.errors import PyMongoError
 from database.db_connection import Database
-from auth.user_model import User
+from auth.user_model import LOGIN_PROJECTION, PROFILE_PROJECTION, User
+from auth.user_history import HISTORY_COLLECTIONS, UserHistory
+from auth.password_hasher import HasherBusy, get_hasher
+from health_rollups import prepareMedications, recordHistory
+
+BUSY_MESSAGE = "Too many sign-ins right now, please try again in a moment"
+
+logger = logging.getLogger("healthlens.auth")
 
 class AuthHandler:
     def __init__(self):
         self.db = Database()
         self.users_collection = self.db.get_collection("users")
-        self.create_indices()
-    
-    def create_indices(self):
-        """Create necessary database indices for user collection"""
-        self.users_collection.create_index("email", unique=True)
+        self.hasher = get_hasher()
+        self.history = UserHistory(self.db.db)
     
     def register_user(self, email, password, name=None, preferred_language="en"):
         """Register a new user"""
         # Check if user already exists
-        if self.users_collection.find_one({"email": email}):
+        if self.users_collection.find_one({"email": email}, {"_id": 1}):
             return False, "User with this email already exists"
         
         # Create new user
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        try:
+            hashed_password = self.hasher.hash(password)
+        except HasherBusy:
+            return False, BUSY_MESSAGE
         
         user = User(email=email, name=name, preferred_language=preferred_language)
         user_dict = user.to_dict()
@@ -34,36 +42,86 @@ class AuthHandler:
     
     def authenticate_user(self, email, password):
         """Authenticate user credentials"""
-        user_data = self.users_collection.find_one({"email": email})
+        user_data = self.users_collection.find_one({"email": email}, LOGIN_PROJECTION)
         
         if not user_data:
             return False, "Invalid email or password"
         
         stored_password = user_data.get("password")
         
-        if bcrypt.checkpw(password.encode('utf-8'), stored_password):
-            user = User.from_dict(user_data)
-            return True, user
-        else:
-            return False, "Invalid email or password"
+        try:
+            if not self.hasher.verify(password, stored_password):
+                return False, "Invalid email or password"
+        except HasherBusy:
+            return False, BUSY_MESSAGE
+        
+        if self.hasher.needs_rehash(stored_password):
+            self.rehash_password(user_data["_id"], password, stored_password)
+        
+        user = User.from_dict(user_data)
+        return True, user
+    
+    def rehash_password(self, user_id, password, stored_password):
+        """Upgrade a stored hash to the configured cost, unless the password changed in the meantime.
+        Best effort and off the login path: it's queued on the hasher and any failure is only logged"""
+        def store(future):
+            try:
+                self.users_collection.update_one(
+                    {"_id": user_id, "password": stored_password},
+                    {"$set": {"password": future.result()}}
+                )
+            except PyMongoError as e:
+                logger.warning("Could not store rehashed password for %s: %s", user_id, e)
+            except Exception:
+                logger.exception("Rehashing the password for %s failed", user_id)
+        
+        try:
+            self.hasher.hash_later(password).add_done_callback(store)
+        except HasherBusy:
+            logger.info("Hasher busy, skipped rehashing the password for %s until the next sign-in", user_id)
     
     def get_user_by_email(self, email):
         """Retrieve user by email"""
-        user_data = self.users_collection.find_one({"email": email})
+        user_data = self.users_collection.find_one({"email": email}, PROFILE_PROJECTION)
         if user_data:
             return User.from_dict(user_data)
         return None
     
+    def load_history(self, user, limit=20):
+        """Fill the user's history lists with the latest `limit` entries of each kind"""
+        for kind in HISTORY_COLLECTIONS:
+            setattr(user, kind, self.history.recent(kind, user.user_id, limit))
+        return user
+    
+    def history_page(self, user, kind, limit=20, before=None):
+        """One page of a user's medication_history or health_records, see UserHistory.page"""
+        return self.history.page(kind, user.user_id, limit, before)
+    
     def update_user(self, user):
-        """Update user information"""
-        user_dict = user.to_dict()
-        user_dict["updated_at"] = datetime.now()
+        """Save the fields that changed and any new history entries.
         
+        Profile changes only apply if the stored version still matches the one this copy was read at,
+        so two sessions editing the same user can't silently overwrite each other.
+        """
         try:
-            self.users_collection.update_one(
-                {"_id": user.user_id},
-                {"$set": user_dict}
-            )
+            if user.dirty_fields():
+                user.updated_at = datetime.now()
+                # Documents written before versioning have no version field
+                version = user.version if user.version else {"$in": [0, None]}
+                result = self.users_collection.update_one(
+                    {"_id": user.user_id, "version": version},
+                    user.changes()
+                )
+                if result.matched_count == 0:
+                    return False, "This profile was changed in another session, reload it and try again"
+                user.mark_saved()
+            
+            # History is append-only, new entries never conflict with another session's
+            new_entries = {kind: user.unsaved_history(kind) for kind in HISTORY_COLLECTIONS}
+            prepareMedications(new_entries["medication_history"])
+            for kind, entries in new_entries.items():
+                self.history.add_many(kind, user.user_id, entries)
+            recordHistory(user.user_id, new_entries["medication_history"], len(new_entries["health_records"]))
             return True, "User updated successfully"
         except Exception as e:
             return False, f"Error updating user: {str(e)}"
@@ -75,7 +133,10 @@ class AuthHandler:
         if not success:
             return False, "Current password is incorrect"
         
-        hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        try:
+            hashed_password = self.hasher.hash(new_password)
+        except HasherBusy:
+            return False, BUSY_MESSAGE
         
         try:
             self.users_collection.update_one(
@@ -0,0 +1,128 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import metrics
+
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashes are already waiting, so a login storm fails fast instead of queueing forever"""
+
+
+def rounds_of(hashed):
+    """Read the cost factor out of a bcrypt hash ($2b$12$...)"""
+    if isinstance(hashed, str):
+        hashed = hashed.encode("utf-8")
+    try:
+        return int(hashed.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small thread pool (bcrypt releases the GIL) so hashing can only ever use
+    `workers` cores, and refuses new work once `max_pending` hashes are queued or running"""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=None, max_pending=32):
+        if not MIN_ROUNDS <= rounds <= MAX_ROUNDS:
+            raise ValueError(f"bcrypt rounds must be between {MIN_ROUNDS} and {MAX_ROUNDS}, got {rounds}")
+        self.rounds = rounds
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def _submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy("Password hashing queue is full")
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def _run(self, fn, *args, timeout=None):
+        return self._submit(fn, *args).result(timeout)
+
+    def _hashpw(self, password):
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(self.rounds))
+
+    def hash(self, password):
+        """Hash a password with the configured cost"""
+        with metrics.span("auth.bcrypt", op="hash"):
+            return self._run(self._hashpw, password)
+
+    def hash_later(self, password):
+        """Queue a hash without waiting for it, returns a Future of the hash (raises HasherBusy like hash)"""
+        return self._submit(self._hashpw, password)
+
+    def verify(self, password, hashed):
+        """Check a password against a stored hash"""
+        if not hashed:
+            return False
+        if isinstance(hashed, str):
+            hashed = hashed.encode("utf-8")
+        with metrics.span("auth.bcrypt", op="verify"):
+            return self._run(bcrypt.checkpw, password.encode("utf-8"), hashed)
+
+    def needs_rehash(self, hashed):
+        """True when a stored hash was made with a different cost than the configured one"""
+        return rounds_of(hashed) != self.rounds
+
+
+def time_rounds(rounds, samples=3):
+    """Median seconds for one hashpw at the given cost on this host"""
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", bcrypt.gensalt(rounds))
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate(target_ms, samples=3, verbose=False):
+    """Find the highest cost whose hash time stays within target_ms on this host"""
+    best = MIN_ROUNDS
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        elapsed = time_rounds(rounds, samples) * 1000
+        if verbose:
+            print(f"rounds={rounds:2d} {elapsed:8.1f} ms")
+        if elapsed > target_ms:
+            break
+        best = rounds
+    return best
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    """Process wide hasher configured from BCRYPT_ROUNDS, BCRYPT_WORKERS and BCRYPT_MAX_PENDING"""
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            workers = os.getenv("BCRYPT_WORKERS")
+            _hasher = PasswordHasher(
+                rounds=int(os.getenv("BCRYPT_ROUNDS", str(DEFAULT_ROUNDS))),
+                workers=int(workers) if workers else None,
+                max_pending=int(os.getenv("BCRYPT_MAX_PENDING", "32"))
+            )
+        return _hasher
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the bcrypt cost for a target hash latency on this host")
+    parser.add_argument("--target-ms", type=float, default=250, help="Longest acceptable time for one hash")
+    parser.add_argument("--samples", type=int, default=3, help="Hashes timed per cost factor")
+    args = parser.parse_args()
+
+    rounds = calibrate(args.target_ms, args.samples, verbose=True)
+    print(f"\nBCRYPT_ROUNDS={rounds}")
@@ -0,0 +1,112 @@
+import argparse
+import hashlib
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import DESCENDING, UpdateOne
+from database.db_connection import Database
+
+# History kind -> collection. Each entry is its own document, ordered by (user_id, added_at, _id),
+# so a user document stays the same size no matter how long the history gets.
+HISTORY_COLLECTIONS = {
+    "medication_history": "medication_history",
+    "health_records": "health_records"
+}
+
+
+class UserHistory:
+    def __init__(self, db=None):
+        self.db = db if db is not None else Database().db
+
+    def collection(self, kind):
+        if kind not in HISTORY_COLLECTIONS:
+            raise ValueError(f"Unknown history kind {kind}, expected one of {list(HISTORY_COLLECTIONS)}")
+        return self.db[HISTORY_COLLECTIONS[kind]]
+
+    def add(self, kind, user_id, entry):
+        """Store one history entry for a user. The entry dict gets its _id and user_id set"""
+        entry["user_id"] = user_id
+        entry.setdefault("added_at", datetime.now())
+        self.collection(kind).insert_one(entry)
+        return entry
+
+    def add_many(self, kind, user_id, entries):
+        if not entries:
+            return []
+        for entry in entries:
+            entry["user_id"] = user_id
+            entry.setdefault("added_at", datetime.now())
+        self.collection(kind).insert_many(entries, ordered=True)
+        return entries
+
+    def page(self, kind, user_id, limit=20, before=None, projection=None):
+        """Newest first page of a user's history.
+
+        Pages with a keyset cursor rather than skip, so page 50 costs the same as page 1:
+        pass the returned cursor as `before` to get the next page.
+        Returns (entries, cursor), cursor is None on the last page.
+        """
+        query = {"user_id": user_id}
+        if before is not None:
+            added_at, entry_id = before
+            query["$or"] = [{"added_at": {"$lt": added_at}},
+                            {"added_at": added_at, "_id": {"$lt": entry_id}}]
+
+        entries = list(self.collection(kind)
+                       .find(query, projection)
+                       .sort([("added_at", DESCENDING), ("_id", DESCENDING)])
+                       .limit(limit + 1))
+        if len(entries) <= limit:
+            return entries, None
+        entries = entries[:limit]
+        return entries, (entries[-1]["added_at"], entries[-1]["_id"])
+
+    def recent(self, kind, user_id, limit=20):
+        """The latest `limit` entries, newest first"""
+        return self.page(kind, user_id, limit)[0]
+
+    def count(self, kind, user_id):
+        return self.collection(kind).count_documents({"user_id": user_id})
+
+
+def migrated_id(user_id, kind, index):
+    """Deterministic ObjectId for the index-th entry of a user's embedded history array"""
+    return ObjectId(hashlib.sha256(f"{user_id}:{kind}:{index}".encode("utf-8")).digest()[:12])
+
+
+# Fn: migrate_embedded()
+# Brief: Moves history arrays still embedded in users documents into the history collections
+# Rets: int - Number of users migrated
+def migrate_embedded(batch_size=100):
+    db = Database().db
+    users = db["users"]
+    migrated = 0
+    embedded = {"$or": [{kind: {"$exists": True}} for kind in HISTORY_COLLECTIONS]}
+
+    for user in users.find(embedded, {kind: 1 for kind in HISTORY_COLLECTIONS}).batch_size(batch_size):
+        created = user["_id"].generation_time.replace(tzinfo=None)
+        for kind, collection_name in HISTORY_COLLECTIONS.items():
+            ops = []
+            for i, entry in enumerate(user.get(kind) or []):
+                entry = dict(entry, user_id=user["_id"])
+                entry.setdefault("added_at", created + timedelta(milliseconds=i)) # BSON dates are millisecond precision
+                # Upsert on an _id derived from (user, kind, position) so rerunning an interrupted migration
+                # doesn't duplicate entries, and entries sharing an added_at don't collapse into one
+                entry.setdefault("_id", migrated_id(user["_id"], kind, i))
+                ops.append(UpdateOne({"_id": entry["_id"]}, {"$setOnInsert": entry}, upsert=True))
+            if ops:
+                db[collection_name].bulk_write(ops, ordered=False)
+
+        users.update_one({"_id": user["_id"]}, {"$unset": {kind: "" for kind in HISTORY_COLLECTIONS}})
+        migrated += 1
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage user history collections")
+    parser.add_argument("--migrate", action="store_true", help="Move embedded history arrays out of users documents")
+    args = parser.parse_args()
+
+    if args.migrate:
+        print(f"Migrated {migrate_embedded()} users")
+    else:
+        parser.print_help()
@@ -1,17 +1,35 @@
 from datetime import datetime
 from bson import ObjectId
 
+# Fields read for a profile. History lives in its own collections (auth/user_history.py) and is never
+# part of the users document, so reads stay the same size however long a patient's history gets.
+PROFILE_PROJECTION = {"email": 1, "name": 1, "preferred_language": 1, "created_at": 1, "updated_at": 1, "version": 1}
+LOGIN_PROJECTION = dict(PROFILE_PROJECTION, password=1)
+
+# Profile fields whose assignments are tracked, so a save only $sets what actually changed
+TRACKED_FIELDS = ("email", "name", "preferred_language")
+
 class User:
-    def __init__(self, email, name=None, preferred_language="en", 
-                 user_id=None, created_at=None, updated_at=None):
+    def __init__(self, email, name=None, preferred_language="en",
+                 user_id=None, created_at=None, updated_at=None, version=0):
+        self._dirty = set()
         self.user_id = user_id if user_id else ObjectId()
         self.email = email
         self.name = name
         self.preferred_language = preferred_language
+        # The loaded window of history plus entries added since, which have no _id until saved
         self.medication_history = []
         self.health_records = []
         self.created_at = created_at if created_at else datetime.now()
         self.updated_at = updated_at if updated_at else datetime.now()
+        # Bumped on every profile save, a save only applies if nobody else saved since this copy was read
+        self.version = version
+        self._dirty.clear()
+    
+    def __setattr__(self, name, value):
+        if name in TRACKED_FIELDS and getattr(self, name, None) != value:
+            self._dirty.add(name)
+        super().__setattr__(name, value)
     
     def to_dict(self):
         return {
@@ -19,10 +37,9 @@ class User:
             "email": self.email,
             "name": self.name,
             "preferred_language": self.preferred_language,
-            "medication_history": self.medication_history,
-            "health_records": self.health_records,
             "created_at": self.created_at,
-            "updated_at": self.updated_at
+            "updated_at": self.updated_at,
+            "version": self.version
         }
     
     @classmethod
@@ -33,12 +50,34 @@ class User:
             preferred_language=data.get("preferred_language"),
             user_id=data.get("_id"),
             created_at=data.get("created_at"),
-            updated_at=data.get("updated_at")
+            updated_at=data.get("updated_at"),
+            version=data.get("version", 0)
         )
-        user.medication_history = data.get("medication_history", [])
-        user.health_records = data.get("health_records", [])
         return user
     
+    def dirty_fields(self):
+        """Tracked profile fields assigned a new value since the user was loaded or last saved"""
+        return set(self._dirty)
+    
+    def changes(self):
+        """The update document for the modified profile fields, or None if nothing changed"""
+        if not self._dirty:
+            return None
+        return {
+            "$set": {field: getattr(self, field) for field in sorted(self._dirty)} | {"updated_at": self.updated_at},
+            "$inc": {"version": 1}
+        }
+    
+    def mark_saved(self):
+        """Called after a successful save, the stored document now matches this copy"""
+        if self._dirty:
+            self.version += 1
+        self._dirty.clear()
+    
+    def unsaved_history(self, kind):
+        """Entries of medication_history or health_records that haven't been stored yet"""
+        return [entry for entry in getattr(self, kind) if "_id" not in entry]
+    
     def add_medication(self, medication_data):
         """Add medication to user's history"""
         medication_data["added_at"] = datetime.now()
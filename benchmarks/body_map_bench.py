@@ -0,0 +1,54 @@
+# Frame time of switching the highlighted drug on the body map: a full figure redraw versus
+# recolouring the region artists and blitting them over the cached background.
+# Run from the repo root: python -m benchmarks.body_map_bench [--frames N]
+import argparse
+import statistics
+import time
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from body_map import BodyMapRenderer
+
+DRUGS = [
+    {"brain": [{"name": "Hypothalamus", "responseType": "POSITIVE"}],
+     "organs": [{"name": "Stomach lining", "responseType": "NEGATIVE"}, {"name": "Kidneys", "responseType": "NEGATIVE"}]},
+    {"organs": [{"name": "Heart", "responseType": "POSITIVE"}, {"name": "Blood vessels", "responseType": "POSITIVE"},
+                {"name": "Lungs", "responseType": "NEGATIVE"}]},
+    {"muscular": [{"name": "Skeletal muscle", "responseType": "NEGATIVE"}],
+     "organs": [{"name": "Liver", "responseType": "NEGATIVE"}]},
+    {},
+]
+
+
+def timeFrames(frames, render):
+    times = []
+    for i in range(frames):
+        start = time.perf_counter()
+        render(DRUGS[i % len(DRUGS)])
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(frames):
+    fig, ax = plt.subplots(figsize=(5, 8), dpi=100)
+    renderer = BodyMapRenderer(ax)
+    fig.canvas.draw()
+
+    def fullRedraw(affections):
+        renderer.highlight(affections)
+        fig.canvas.draw()
+
+    results = {
+        "full redraw": timeFrames(frames, fullRedraw),
+        "blitted update": timeFrames(frames, renderer.highlight),
+    }
+    for name, times in results.items():
+        times = sorted(times)
+        p95 = times[int(len(times) * 0.95) - 1]
+        print(f"{name:<15} median {statistics.median(times) * 1000:7.2f}ms  p95 {p95 * 1000:7.2f}ms  ({frames} frames)")
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--frames", type=int, default=200)
+    run(argParser.parse_args().frames)
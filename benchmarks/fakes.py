@@ -0,0 +1,133 @@
+# Local stand-ins so benchmarks measure this code rather than the network: a fake Gemini client
+# with configurable latency answering from a canned corpus, and mongomock as an in-process MongoDB.
+import asyncio
+import os
+import random
+import re
+from types import SimpleNamespace
+
+DRUG_RESPONSE = """```json
+{
+  "genericName": "%(name)s",
+  "brain": [
+    {"name": "Hypothalamus", "responseType": "POSITIVE", "responseDescription": "Lowers the body's temperature set point, which brings a fever down."},
+    {"name": "Pain pathways in the spinal cord", "responseType": "POSITIVE", "responseDescription": "Dampens pain signals travelling to the brain."}
+  ],
+  "muscular": [
+    {"name": "Skeletal muscle", "responseType": "POSITIVE", "responseDescription": "Eases soreness and stiffness after strain."}
+  ],
+  "skeletal": [],
+  "organs": [
+    {"name": "Stomach lining", "responseType": "NEGATIVE", "responseDescription": "Can irritate the stomach and cause heartburn or ulcers with long use."},
+    {"name": "Kidneys", "responseType": "NEGATIVE", "responseDescription": "Reduces blood flow to the kidneys, which matters if they are already weak."},
+    {"name": "Heart and blood vessels", "responseType": "NEGATIVE", "responseDescription": "Slightly raises blood pressure in some people."}
+  ]
+}
+```"""
+
+LABEL_RESPONSE = """Medication: Lisinopril 10mg
+
+Instructions: Take one tablet by mouth once daily
+
+Prescribing Doctor: Dr. Smith
+
+Purpose: This medication is an ACE inhibitor used to treat high blood pressure and heart failure.
+
+Common Side Effects:
+- Dizziness
+- Cough
+- Headache
+
+Take with or without food. Avoid potassium supplements."""
+
+DOCTORS_NOTE_RESPONSE = """```json
+{
+  "originalText": "Pt presents w/ persistent dry cough x3 wks. Likely ACE-i induced. D/C lisinopril, start losartan 50mg PO daily. F/u 4 wks w/ BMP.",
+  "outputContent": {
+    "text": "Your cough is probably caused by your blood pressure pill. Stop taking lisinopril and take one losartan tablet every day instead. Come back in four weeks for a blood test.",
+    "prescribed": [
+      {"name": "Losartan 50mg", "instructions": "Take one tablet by mouth every day", "purpose": "Controls blood pressure"}
+    ]
+  },
+  "originalLanguage": "english",
+  "outputLanguage": "english"
+}
+```"""
+
+DRUG_NAME = re.compile(r"<drug_name>\s*(.+?)\s*</drug_name>", re.DOTALL)
+
+
+# Picks the canned answer for a request from what the prompt asks for
+def cannedResponse(contents):
+    text = " ".join(part for part in contents if isinstance(part, str))
+    match = DRUG_NAME.search(text)
+    if match:
+        return DRUG_RESPONSE % {"name": match.group(1).strip().lower()}
+    if "doctors note" in text:
+        return DOCTORS_NOTE_RESPONSE
+    return LABEL_RESPONSE
+
+
+class FakeModels:
+    def __init__(self, latency, jitter, chunkSize):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunkSize = chunkSize
+        self.calls = 0
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def usage(self, contents, text):
+        promptChars = sum(len(part) for part in contents if isinstance(part, str))
+        return SimpleNamespace(prompt_token_count=promptChars // 4, candidates_token_count=len(text) // 4)
+
+    async def generate_content(self, model, contents, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay())
+        text = cannedResponse(contents)
+        return SimpleNamespace(text=text, usage_metadata=self.usage(contents, text))
+
+    async def generate_content_stream(self, model, contents, **kwargs):
+        self.calls += 1
+        text = cannedResponse(contents)
+        chunks = [text[i:i + self.chunkSize] for i in range(0, len(text), self.chunkSize)]
+        delay = self.delay()
+
+        async def stream():
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(delay / len(chunks))
+                usage = self.usage(contents, text) if i == len(chunks) - 1 else None
+                yield SimpleNamespace(text=chunk, usage_metadata=usage)
+        return stream()
+
+
+# Fn: installGemini()
+# Brief: Routes client.py's model calls to a FakeModels instance
+# Rets: FakeModels - to read .calls or change .latency between cases
+def installGemini(latency=0.25, jitter=0.0, chunkSize=64):
+    import client
+
+    models = FakeModels(latency, jitter, chunkSize)
+    fake = SimpleNamespace(models=models)
+    client.getAsyncClient = lambda: fake
+    return models
+
+
+# Fn: installMongo()
+# Brief: Makes database.db_connection hand out one in-process mongomock client, with the schema applied
+# Rets: The mongomock database
+def installMongo():
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("The benchmarks need mongomock as a local MongoDB: pip install -r benchmarks/requirements.txt")
+
+    from database import db_connection
+    from database.schema import apply_schema
+
+    db_connection._client = mongomock.MongoClient()
+    db_connection._client_pid = os.getpid()
+    db = db_connection.Database().db
+    apply_schema(db)
+    return db
@@ -0,0 +1,43 @@
+# Measures how much the scan preprocessing shrinks the bundled sample images and what it costs.
+# Run from the repo root: python -m benchmarks.preprocess_bench [--repeat N]
+import argparse
+import statistics
+import PIL.Image
+from image_preprocess import ImagePreprocessor
+
+SAMPLES = ["pills.jpg", "docNote2.jpg"]
+
+CONFIGS = {
+    "default": dict(),
+    "grayscale": dict(grayscale=True),
+    "auto-crop": dict(crop="auto"),
+    "small": dict(maxEdge=1024, byteBudget=150 * 1024),
+}
+
+
+def run(repeat):
+    for path in SAMPLES:
+        with PIL.Image.open(path) as image:
+            image.load()
+            print(f"{path}: {image.size[0]}x{image.size[1]}")
+
+            for name, options in CONFIGS.items():
+                preprocessor = ImagePreprocessor(**options)
+                totals = []
+                steps = {}
+                for _ in range(repeat):
+                    result = preprocessor.process(image)
+                    totals.append(sum(result.timings.values()))
+                    for step, seconds in result.timings.items():
+                        steps.setdefault(step, []).append(seconds)
+
+                stepText = " ".join(f"{step}={statistics.median(times) * 1000:.1f}ms" for step, times in steps.items())
+                ratio = result.bytes / result.originalBytes if result.originalBytes else 0
+                print(f"  {name:<10} {result.size[0]:>4}x{result.size[1]:<4} {result.originalBytes:>8} -> {result.bytes:>8} bytes "
+                      f"({ratio:.0%}) median {statistics.median(totals) * 1000:.1f}ms [{stepText}]")
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--repeat", type=int, default=10)
+    run(argParser.parse_args().repeat)
@@ -0,0 +1,200 @@
+# Benchmarks the main request paths against local fakes (benchmarks/fakes.py) and writes the timings
+# as JSON, so a run on one commit can be compared with another.
+# Run from the repo root:
+#   python -m benchmarks.suite [--repeat N] [--latency S] [--only case,...] [--out FILE] [--compare OLD.json]
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# Before anything imports client.py: no response cache (it would turn every miss into a hit) and no
+# metrics server
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+os.environ.setdefault("METRICS_ENABLED", "0")
+
+import PIL.Image
+from benchmarks.fakes import DOCTORS_NOTE_RESPONSE, DRUG_RESPONSE, installGemini, installMongo
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+
+# Fn: measure()
+# Brief: Times fn(i) for i in range(repeat) after a few warmup calls
+# Rets: dict - summary statistics in milliseconds
+def measure(fn, repeat, warmup=2):
+    for i in range(warmup):
+        fn(-1 - i)
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": times[0],
+        "median_ms": statistics.median(times),
+        "p95_ms": times[min(len(times) - 1, int(round(len(times) * 0.95)) - 1)],
+        "mean_ms": statistics.fmean(times),
+        "max_ms": times[-1],
+        "ops_per_s": 1000 / statistics.fmean(times) if statistics.fmean(times) else None
+    }
+
+
+def benchFindAffected(repeat, runId):
+    from drug_affection import DrugRegionParser
+
+    DrugRegionParser("ibuprofen").findAffected() # Stored once, every hit below reads it back
+    return {
+        "find_affected.hit": measure(lambda i: DrugRegionParser("Advil 200mg" if i % 2 else "ibuprofen").findAffected(), repeat),
+        # A new name every call, so each one prompts, parses and stores
+        "find_affected.miss": measure(lambda i: DrugRegionParser(f"benchdrug{runId}x{i + 10}").findAffected(), repeat)
+    }
+
+
+def benchImageToText(repeat):
+    from imageToText import ImageToDoctorsNote, ImageToFacts
+
+    results = {}
+    for case, extractor, path in (("image_to_text.facts.pills", ImageToFacts(dedupScope="bench"), "pills.jpg"),
+                                  ("image_to_text.note.docNote2", ImageToDoctorsNote("english", dedupScope="bench"), "docNote2.jpg")):
+        with PIL.Image.open(path) as image:
+            image.load()
+        dedupIndex = extractor.dedupIndex
+        extractor.dedupIndex = None # Every call goes through preprocessing and the model
+        results[case] = measure(lambda i: extractor.process(image), repeat)
+        if dedupIndex is not None:
+            extractor.dedupIndex = dedupIndex
+            extractor.process(image)
+            results[case + ".dedup_hit"] = measure(lambda i: extractor.process(image), repeat)
+    return results
+
+
+def benchParsing(repeat):
+    from client import stripJsonTag
+    from drug_affection import DrugRegionParser
+
+    drugResponse = DRUG_RESPONSE % {"name": "ibuprofen"}
+    parser = DrugRegionParser("ibuprofen")
+    repeat *= 100 # Microsecond scale, more samples for a stable median
+    return {
+        "parse.strip_json_tag": measure(lambda i: stripJsonTag(drugResponse), repeat),
+        "parse.drug_response": measure(lambda i: parser.buildDrug(stripJsonTag(drugResponse)), repeat),
+        "parse.doctors_note": measure(lambda i: json.loads(stripJsonTag(DOCTORS_NOTE_RESPONSE)), repeat)
+    }
+
+
+def benchAuth(repeat, runId):
+    from auth.auth_handler import AuthHandler
+
+    handler = AuthHandler()
+    handler.register_user(f"login{runId}@bench.local", "correct horse battery", name="Bench")
+    return {
+        "auth.register": measure(lambda i: handler.register_user(f"user{runId}x{i + 10}@bench.local", "correct horse battery"), repeat),
+        "auth.login": measure(lambda i: handler.authenticate_user(f"login{runId}@bench.local", "correct horse battery"), repeat)
+    }
+
+
+def benchUserModel(repeat):
+    from auth.user_model import User
+
+    user = User("patient@bench.local", name="Long Term Patient", preferred_language="fr")
+    data = user.to_dict()
+    repeat *= 100
+    return {
+        "user.to_dict": measure(lambda i: user.to_dict(), repeat),
+        "user.from_dict": measure(lambda i: User.from_dict(data), repeat)
+    }
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Fn: compare()
+# Brief: Prints the median change of every case present in both result files
+def compare(old, new, threshold=0.10):
+    regressions = 0
+    for case, stats in new["results"].items():
+        before = old["results"].get(case)
+        if not before:
+            continue
+        change = (stats["median_ms"] - before["median_ms"]) / before["median_ms"] if before["median_ms"] else 0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{case:<40} {before['median_ms']:>10.3f} -> {stats['median_ms']:>10.3f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+CASES = {
+    "find_affected": lambda args, runId: benchFindAffected(args.repeat, runId),
+    "image_to_text": lambda args, runId: benchImageToText(args.repeat),
+    "parse": lambda args, runId: benchParsing(args.repeat),
+    "auth": lambda args, runId: benchAuth(args.repeat, runId),
+    "user": lambda args, runId: benchUserModel(args.repeat),
+}
+
+
+def main(argv=None):
+    argParser = argparse.ArgumentParser(description="Benchmark HealthLens request paths against local fakes")
+    argParser.add_argument("--repeat", type=int, default=20, help="Timed calls per case (x100 for microsecond cases)")
+    argParser.add_argument("--latency", type=float, default=0.05, help="Fake model latency in seconds")
+    argParser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the fake latency")
+    argParser.add_argument("--bcrypt-rounds", type=int, default=10, help="BCRYPT_ROUNDS for the auth cases")
+    argParser.add_argument("--only", help="Comma separated case groups: " + ", ".join(CASES))
+    argParser.add_argument("--out", help="Where to write the results (default: benchmarks/results/<commit>-<time>.json)")
+    argParser.add_argument("--compare", help="Earlier results file to compare against, exits 1 on a >10%% median regression")
+    args = argParser.parse_args(argv)
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    installMongo()
+    models = installGemini(args.latency, args.jitter)
+
+    runId = int(time.time())
+    groups = args.only.split(",") if args.only else list(CASES)
+    results = {}
+    for group in groups:
+        print(f"Running {group}...", file=sys.stderr)
+        results.update(CASES[group](args, runId))
+
+    report = {
+        "commit": gitCommit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"repeat": args.repeat, "latency": args.latency, "jitter": args.jitter,
+                   "bcrypt_rounds": args.bcrypt_rounds, "model_calls": models.calls},
+        "results": results
+    }
+
+    for case, stats in results.items():
+        print(f"{case:<40} median {stats['median_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms")
+
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{report['commit'] or 'nogit'}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            return 1 if compare(json.load(f), report) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
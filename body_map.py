@@ -0,0 +1,138 @@
+import numpy as np
+import matplotlib.patches as patches
+from body_regions import BODY_REGIONS, regionStates
+
+POSITIVE_COLOR = "#66BB6A"
+NEGATIVE_COLOR = "#EF5350"
+MIXED_COLOR = "#FFA726"
+LABEL_COLOR = "#424242"
+
+
+def makeShape(kind, params):
+    if kind == "circle":
+        return patches.Circle(params["xy"], params["radius"])
+    if kind == "ellipse":
+        return patches.Ellipse(params["xy"], params["width"], params["height"])
+    return patches.Rectangle(params["xy"], params["width"], params["height"])
+
+
+# Draws the body map on an axes. The static parts of the figure are rendered once and cached;
+# highlighting a drug only recolours the region artists and blits them over the cached background.
+class BodyMapRenderer:
+    STATE_COLORS = {"POSITIVE": POSITIVE_COLOR, "NEGATIVE": NEGATIVE_COLOR, "MIXED": MIXED_COLOR}
+
+    def __init__(self, ax, geometry=BODY_REGIONS, animated=True, labelColor=LABEL_COLOR):
+        self.ax = ax
+        self.animated = animated # False for one-off renders (savefig skips animated artists)
+        self.canvas = ax.figure.canvas
+        self.background = None
+        self.labelOverlay = None # Labels pre-rendered to RGBA, text layout is the slowest part of a frame
+        self.states = dict()
+        self.artists = dict() # region name -> list of patches
+        self.labels = []
+        self.regions = {region["name"]: region for region in geometry}
+
+        for region in geometry:
+            shapes = []
+            for kind, params in region["shapes"]:
+                shape = makeShape(kind, params)
+                shape.set_animated(animated)
+                self.applyStyle(region, shape, None)
+                ax.add_patch(shape)
+                shapes.append(shape)
+            self.artists[region["name"]] = shapes
+
+            for xy, text, fontsize in region["labels"]:
+                label = ax.text(xy[0], xy[1], text, ha='center', va='center', fontsize=fontsize,
+                                fontweight='bold', color=labelColor, animated=animated)
+                self.labels.append(label)
+
+        ax.set_xlim(0, 1)
+        ax.set_ylim(0, 1)
+        ax.axis('off')
+
+        # Any full redraw (first show, resize) invalidates the cached background
+        if animated:
+            self.drawConnection = self.canvas.mpl_connect("draw_event", self.onDraw)
+
+    def applyStyle(self, region, shape, state):
+        fill = region.get("fill", True)
+        color = self.STATE_COLORS.get(state, region["color"])
+        shape.set_fill(fill)
+        shape.set_linewidth(region.get("linewidth", 0) + (2 if state and not fill else 0))
+        shape.set_alpha(region["alpha"] if state is None else max(region["alpha"], 0.85))
+        if fill:
+            shape.set_facecolor(color)
+            shape.set_edgecolor("none")
+        else:
+            shape.set_edgecolor(color)
+
+    def onDraw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.labelOverlay = self.renderLabels()
+        self.drawAnimated()
+
+    # Fn: renderLabels()
+    # Brief: Draws the labels alone onto a cleared Agg buffer and keeps the pixels, then puts the figure back
+    # Rets: tuple - (x, y, RGBA array) ready for draw_image, or None if the canvas isn't Agg based
+    def renderLabels(self):
+        renderer = self.canvas.get_renderer()
+        if not hasattr(renderer, "buffer_rgba") or not hasattr(renderer, "clear"):
+            return None
+
+        figure = self.canvas.copy_from_bbox(self.ax.figure.bbox)
+        renderer.clear()
+        for label in self.labels:
+            self.ax.draw_artist(label)
+        pixels = np.asarray(renderer.buffer_rgba())
+        x0, y0, x1, y1 = [int(round(value)) for value in self.ax.bbox.extents]
+        height = pixels.shape[0]
+        overlay = pixels[height - y1:height - y0, x0:x1][::-1].copy() # draw_image wants bottom row first
+        self.canvas.restore_region(figure)
+        return x0, y0, overlay
+
+    def drawAnimated(self):
+        for shapes in self.artists.values():
+            for shape in shapes:
+                self.ax.draw_artist(shape)
+
+        if self.labelOverlay is None:
+            for label in self.labels:
+                self.ax.draw_artist(label)
+        else:
+            x, y, overlay = self.labelOverlay
+            renderer = self.canvas.get_renderer()
+            gc = renderer.new_gc()
+            renderer.draw_image(gc, x, y, overlay)
+            gc.restore()
+
+    # Fn: highlight()
+    # Brief: Colours the regions a drug affects, POSITIVE green, NEGATIVE red, both orange
+    def highlight(self, affections):
+        self.applyHighlight(affections)
+        if self.animated:
+            self.refresh()
+
+    # Fn: applyHighlight()
+    # Brief: Recolours the regions whose state changed without drawing anything
+    def applyHighlight(self, affections):
+        states = regionStates(affections)
+        for name, shapes in self.artists.items():
+            if states.get(name) == self.states.get(name):
+                continue
+            for shape in shapes:
+                self.applyStyle(self.regions[name], shape, states.get(name))
+        self.states = states
+
+    def clear(self):
+        self.highlight({})
+
+    # Fn: refresh()
+    # Brief: Restores the cached background and redraws only the animated artists
+    def refresh(self):
+        if self.background is None:
+            self.canvas.draw() # Caches the background via onDraw
+        else:
+            self.canvas.restore_region(self.background)
+            self.drawAnimated()
+        self.canvas.blit(self.ax.bbox)
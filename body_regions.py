@@ -0,0 +1,91 @@
+# Canonical body regions. Each has the shapes drawn for it, its resting colour, where its label goes
+# and the words in an affection name that map onto it. Plain data with no plotting imports, so code
+# that only resolves regions (health_rollups on the login path) doesn't load matplotlib; body_map draws it.
+BODY_REGIONS = [
+    {
+        "name": "body",
+        "shapes": [("rectangle", dict(xy=(0.3, 0.1), width=0.4, height=0.8))],
+        "fill": False, "color": "#424242", "alpha": 1.0, "linewidth": 3,
+        "labels": [],
+        "keywords": ["muscle", "bone", "skeletal", "joint", "skin", "back", "limb"]
+    },
+    {
+        "name": "brain",
+        "shapes": [("circle", dict(xy=(0.5, 0.9), radius=0.1))],
+        "color": "#90CAF9", "alpha": 0.5,
+        "labels": [((0.5, 0.9), "Brain", 10)],
+        "keywords": ["brain", "cerebr", "cortex", "nerv", "hypothalam", "thalam", "cerebell", "hippocamp",
+                     "amygdala", "medulla", "pituitary", "spinal"]
+    },
+    {
+        "name": "lungs",
+        "shapes": [("ellipse", dict(xy=(0.4, 0.65), width=0.1, height=0.15)),
+                   ("ellipse", dict(xy=(0.6, 0.65), width=0.1, height=0.15))],
+        "color": "#FFCC80", "alpha": 0.6,
+        "labels": [((0.4, 0.65), "Lung", 9), ((0.6, 0.65), "Lung", 9)],
+        "keywords": ["lung", "pulmonary", "respirat", "airway", "bronch", "breath", "cough"]
+    },
+    {
+        "name": "heart",
+        "shapes": [("circle", dict(xy=(0.5, 0.65), radius=0.08))],
+        "color": "#EF9A9A", "alpha": 0.7,
+        "labels": [((0.5, 0.65), "Heart", 10)],
+        "keywords": ["heart", "cardi", "blood vessel", "arter", "vein", "vascular", "blood pressure", "circulat"]
+    },
+    {
+        "name": "stomach",
+        "shapes": [("ellipse", dict(xy=(0.5, 0.5), width=0.15, height=0.1))],
+        "color": "#81C784", "alpha": 0.5,
+        "labels": [((0.5, 0.5), "Stomach", 10)],
+        "keywords": ["stomach", "gastr", "digest", "intestin", "bowel", "colon", "gut", "esophag", "pancrea"]
+    },
+    {
+        "name": "liver",
+        "shapes": [("ellipse", dict(xy=(0.4, 0.45), width=0.1, height=0.08))],
+        "color": "#A1887F", "alpha": 0.6,
+        "labels": [((0.4, 0.45), "Liver", 9)],
+        "keywords": ["liver", "hepat", "gallbladder", "bile"]
+    },
+    {
+        "name": "kidneys",
+        "shapes": [("ellipse", dict(xy=(0.4, 0.4), width=0.08, height=0.05)),
+                   ("ellipse", dict(xy=(0.6, 0.4), width=0.08, height=0.05))],
+        "color": "#9575CD", "alpha": 0.7,
+        "labels": [((0.5, 0.4), "Kidneys", 10)],
+        "keywords": ["kidney", "renal", "urin", "bladder", "nephr"]
+    }
+]
+
+REGIONS_BY_NAME = {region["name"]: region for region in BODY_REGIONS}
+# Organs are matched before the whole-body outline so "stomach muscle" lands on the stomach
+MATCH_ORDER = [region for region in BODY_REGIONS if region["name"] != "body"] + [REGIONS_BY_NAME["body"]]
+SYSTEM_DEFAULTS = {"brain": "brain", "muscular": "body", "skeletal": "body"}
+
+
+# Fn: resolveRegion()
+# Brief: Maps one affection (its body system and free-text name) onto a canonical region
+# Rets: str - The region name, or None if it isn't drawn on the map
+def resolveRegion(system, name):
+    text = (name or "").lower()
+    if system == "brain":
+        return "brain"
+    for region in MATCH_ORDER:
+        if any(keyword in text for keyword in region["keywords"]):
+            return region["name"]
+    return SYSTEM_DEFAULTS.get(system)
+
+
+# Fn: regionStates()
+# Brief: Works out how each region is affected by a drug's affections
+# Rets: dict - region name -> "POSITIVE", "NEGATIVE" or "MIXED"
+def regionStates(affections):
+    states = dict()
+    for system, effects in (affections or {}).items():
+        for effect in effects or []:
+            region = resolveRegion(system, effect.get("name"))
+            responseType = effect.get("responseType")
+            if not region or responseType not in ("POSITIVE", "NEGATIVE"):
+                continue
+            previous = states.get(region)
+            states[region] = responseType if previous in (None, responseType) else "MIXED"
+    return states
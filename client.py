@@ -1,10 +1,32 @@
 from google import genai
+from google.genai import types
 from dotenv import load_dotenv
+from response_cache import MISS, getCache, makeKey
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from contextlib import AsyncExitStack, asynccontextmanager
+import gemini_cassette
+import llm_limiter
+import metrics
+import model_routing
+import asyncio
 import os
+import queue
+import threading
+import time
+import weakref
 
 load_dotenv()
 API_KEY = os.environ.get('GEMINI_KEY')
+MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '8'))
+# Background lane requests also need one of these slots, so bulk work can't occupy every connection
+BACKGROUND_CONCURRENCY = int(os.environ.get('GEMINI_BACKGROUND_CONCURRENCY', str(max(1, MAX_CONCURRENCY // 2))))
+MAX_ATTEMPTS = int(os.environ.get('GEMINI_MAX_ATTEMPTS', '5'))
 client = None
+asyncClients = weakref.WeakKeyDictionary() # One aio client per event loop, its http session can't cross loops
+semaphores = weakref.WeakKeyDictionary()
+backgroundSemaphores = weakref.WeakKeyDictionary()
+backgroundLoop = None
+backgroundLock = threading.Lock()
 prompts = dict()
 promptFormatting = dict()
 promptHeader = None
@@ -27,13 +49,130 @@ def getFormatting(formatName):
 
     return promptFormatting[formatName]
 
+# Fn: getClient()
+# Brief: Sync client whose calls share the rate limiter, lanes and retries with everything else
 def getClient():
     global client
     if not client:
-        client = genai.Client(api_key=API_KEY)
+        client = TransportClient()
 
     return client
 
+# Fn: getAsyncClient()
+# Brief: Returns the async (aio) client bound to the running event loop, or the record/replay
+#        transport standing in for it (GEMINI_TRANSPORT, see gemini_cassette)
+def getAsyncClient():
+    loop = asyncio.get_running_loop()
+    if loop not in asyncClients:
+        asyncClients[loop] = gemini_cassette.wrapAsyncClient(lambda: genai.Client(api_key=API_KEY).aio)
+    return asyncClients[loop]
+
+# Sync models API over the async client, so getClient() callers go through the transport and limiter too
+class TransportModels:
+    def generate_content(self, **kwargs):
+        async def call():
+            async for attempt in retrying():
+                with attempt:
+                    async with requestSlot():
+                        response = await getAsyncClient().models.generate_content(**kwargs)
+            return response
+        return runSync(call())
+
+class TransportClient:
+    def __init__(self):
+        self.models = TransportModels()
+
+# Fn: setMaxConcurrency()
+# Brief: Changes how many model requests may be in flight at once per event loop
+def setMaxConcurrency(limit: int):
+    global MAX_CONCURRENCY
+    if limit < 1:
+        raise ValueError("Concurrency limit must be at least 1")
+    MAX_CONCURRENCY = limit
+    semaphores.clear() # Requests already holding a slot finish on the old semaphore
+    backgroundSemaphores.clear()
+
+def getSemaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in semaphores:
+        semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return semaphores[loop]
+
+def getBackgroundSemaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in backgroundSemaphores:
+        backgroundSemaphores[loop] = asyncio.Semaphore(min(BACKGROUND_CONCURRENCY, MAX_CONCURRENCY))
+    return backgroundSemaphores[loop]
+
+# Fn: requestSlot()
+# Brief: Waits for a rate limiter token and a concurrency slot in the current lane (see llm_limiter),
+#        reporting how long that took
+@asynccontextmanager
+async def requestSlot():
+    lane = llm_limiter.currentLane.get()
+    start = time.perf_counter()
+    await llm_limiter.acquire()
+    async with AsyncExitStack() as stack:
+        if lane != llm_limiter.INTERACTIVE:
+            await stack.enter_async_context(getBackgroundSemaphore())
+        await stack.enter_async_context(getSemaphore())
+        llm_limiter.observeWait(lane, time.perf_counter() - start)
+        yield
+
+# Fn: retrying()
+# Brief: Retries 429s and 5xx with jittered exponential backoff, each attempt waits for its own slot
+def retrying():
+    return AsyncRetrying(
+        retry=retry_if_exception(llm_limiter.isRetryable),
+        wait=wait_random_exponential(multiplier=0.5, max=30),
+        stop=stop_after_attempt(MAX_ATTEMPTS),
+        reraise=True)
+
+def getBackgroundLoop():
+    global backgroundLoop
+    with backgroundLock:
+        if backgroundLoop is None or backgroundLoop.is_closed():
+            backgroundLoop = asyncio.new_event_loop()
+            threading.Thread(target=backgroundLoop.run_forever, name="gemini-loop", daemon=True).start()
+    return backgroundLoop
+
+# Fn: runSync()
+# Brief: Runs a coroutine on the shared background loop and blocks until it finishes.
+#        Sync callers share one loop so the semaphore bounds all of them together.
+def runSync(coro):
+    coro = llm_limiter.inLane(coro, llm_limiter.currentLane.get()) # The caller's lane doesn't cross threads by itself
+    return asyncio.run_coroutine_threadsafe(coro, getBackgroundLoop()).result()
+
+# Fn: runSyncStream()
+# Brief: Iterates an async generator on the background loop, handing each item to the calling thread as it arrives
+def runSyncStream(agen):
+    items = queue.Queue()
+    done = object()
+    lane = llm_limiter.currentLane.get()
+
+    async def pump():
+        llm_limiter.currentLane.set(lane) # pump runs as its own task, this only affects it
+        try:
+            async for item in agen:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((None, e))
+            raise
+        finally:
+            items.put((done, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), getBackgroundLoop())
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        future.cancel() # Consumer stopped early, stop the generation too
+
 def stripJsonTag(text):
     # Remove ```json and ``` if present
     if text.startswith("```json") and text.endswith("```"):
@@ -42,26 +181,173 @@ def stripJsonTag(text):
         text = text[3:-3].strip()  # Remove the first and last 3 characters (```)
     return text
 
-# Fn: prompt()
-# Brief: Returns a prompt, with the added header to ensure gemini doesn't add a warning or anything to the text
-def textPrompt(text, useHeader = True):
+# Fn: generate()
+# Brief: Sends the contents to the task's model, going through the response cache, the concurrency limit
+#        and model_routing (timeout, hedging, fallback)
+# Args: validate - optional fn(text) raising ValueError when the caller can't use the response. Rejected
+#       responses are raised instead of cached, and a cached one that's rejected is dropped and re-requested
+async def generate(key, contents, task=model_routing.DEFAULT, validate=None):
+    cache = getCache()
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not MISS and validate is not None:
+        try:
+            validate(cached)
+        except ValueError:
+            await asyncio.to_thread(cache.delete, key)
+            cached = MISS
+    metrics.countCache("response", cached is not MISS)
+    if cached is not MISS:
+        return cached
+
+    metrics.countUpload(uploadBytes(contents))
+
+    async def request(model, call):
+        async for attempt in retrying():
+            with attempt:
+                async with requestSlot():
+                    with metrics.span("llm.generate", model=model, task=task), call.timing():
+                        response = await getAsyncClient().models.generate_content(
+                            model=model,
+                            contents=contents)
+        return response
+
+    response = await model_routing.route(task, request)
+    metrics.countUsage(response)
+
+    with metrics.span("llm.parse"):
+        result = stripJsonTag(response.text)
+        if validate is not None:
+            validate(result)
+    await asyncio.to_thread(cache.set, key, result)
+    return result
+
+# Fn: openStream()
+# Brief: Starts a streamed response and waits for its first chunk, retrying like generate() until then.
+#        Later failures aren't retried, the caller can't take back text it already has
+# Rets: (AsyncExitStack holding the request slot and stream, first chunk or None)
+async def openStream(contents, model, call):
+    async for attempt in retrying():
+        with attempt:
+            slot = AsyncExitStack()
+            await slot.enter_async_context(requestSlot())
+            try:
+                with call.timing(): # Until the first chunk, what the task's hedge delay is based on
+                    stream = await getAsyncClient().models.generate_content_stream(
+                        model=model,
+                        contents=contents)
+                    if hasattr(stream, "aclose"):
+                        slot.push_async_callback(stream.aclose)
+                    first = await anext(stream, None)
+            except BaseException:
+                await slot.aclose()
+                raise
+    return slot, stream, first
+
+async def closeStream(opened):
+    await opened[0].aclose()
+
+# Fn: generateStream()
+# Brief: Streaming version of generate(), yields text chunks as the model produces them.
+#        A cache hit is yielded as one chunk; the full response is cached once the stream completes
+async def generateStream(key, contents, task=model_routing.DEFAULT):
+    cache = getCache()
+    cached = await asyncio.to_thread(cache.get, key)
+    metrics.countCache("response", cached is not MISS)
+    if cached is not MISS:
+        yield cached
+        return
+
+    chunks = []
+    metrics.countUpload(uploadBytes(contents))
+    # Only opening the stream is routed, once text is flowing it can't be hedged or moved to another model
+    slot, stream, chunk = await model_routing.route(task, lambda model, call: openStream(contents, model, call), closeStream)
+    async with slot:
+        with metrics.span("llm.stream", task=task):
+            last = chunk
+            while chunk is not None:
+                last = chunk
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+                chunk = await anext(stream, None)
+    metrics.countUsage(last) # The last chunk carries the usage for the whole response
+
+    await asyncio.to_thread(cache.set, key, stripJsonTag("".join(chunks).strip()))
+
+# Fn: uploadBytes()
+# Brief: Size of the inline image data in a request
+def uploadBytes(contents):
+    size = 0
+    for part in contents:
+        inline = getattr(part, "inline_data", None)
+        if inline is not None and inline.data:
+            size += len(inline.data)
+    return size
+
+def textRequest(text, useHeader, task):
+    model = model_routing.getRoute(task).model
+    header = getPromptHeader() if useHeader else None
     contents = []
     if useHeader:
-        contents = [f"{getPromptHeader()} {text}"]
+        contents = [f"{header} {text}"]
     else:
         contents = [text]
 
-    response = getClient().models.generate_content(
-        model="gemini-2.0-flash",
-        contents=contents)
+    return makeKey(model, header, text), contents
+
+def imageRequest(text, image, mimeType, task):
+    header = getPromptHeader()
+    key = makeKey(model_routing.getRoute(task).model, header, text, image)
+    if isinstance(image, (bytes, bytearray)):
+        image = types.Part.from_bytes(data=bytes(image), mime_type=mimeType)
+    return key, [f"{header} {text}", image]
+
+async def textPromptAsync(text, useHeader = True, task = model_routing.DEFAULT, validate = None):
+    return await generate(*textRequest(text, useHeader, task), task, validate)
+
+# Fn: imagePromptAsync()
+# Brief: Prompts with an image, either a PIL image or already encoded bytes (see image_preprocess)
+async def imagePromptAsync(text, image, mimeType = "image/jpeg", task = model_routing.DEFAULT):
+    return await generate(*imageRequest(text, image, mimeType, task), task)
+
+def textPromptStreamAsync(text, useHeader = True, task = model_routing.DEFAULT):
+    return generateStream(*textRequest(text, useHeader, task), task)
+
+def imagePromptStreamAsync(text, image, mimeType = "image/jpeg", task = model_routing.DEFAULT):
+    return generateStream(*imageRequest(text, image, mimeType, task), task)
+
+# Fn: textPromptManyAsync()
+# Brief: Fans the prompts out concurrently (bounded by the semaphore)
+# Rets: list - responses in the same order as the prompts. With returnExceptions a failed prompt's slot holds its exception
+async def textPromptManyAsync(texts, useHeader = True, returnExceptions = False, task = model_routing.DEFAULT, validate = None):
+    return await asyncio.gather(*(textPromptAsync(text, useHeader, task, validate) for text in texts), return_exceptions=returnExceptions)
+
+# Fn: imagePromptManyAsync()
+# Brief: Same as textPromptManyAsync, for (text, image) pairs
+async def imagePromptManyAsync(requests, returnExceptions = False, task = model_routing.DEFAULT):
+    return await asyncio.gather(*(imagePromptAsync(text, image, task=task) for text, image in requests), return_exceptions=returnExceptions)
+
+# Fn: prompt()
+# Brief: Returns a prompt, with the added header to ensure gemini doesn't add a warning or anything to the text
+def textPrompt(text, useHeader = True, task = model_routing.DEFAULT, validate = None):
+    return runSync(textPromptAsync(text, useHeader, task, validate))
+
+def imagePrompt(text, image, mimeType = "image/jpeg", task = model_routing.DEFAULT):
+    return runSync(imagePromptAsync(text, image, mimeType, task))
+
+def textPromptMany(texts, useHeader = True, returnExceptions = False, task = model_routing.DEFAULT, validate = None):
+    return runSync(textPromptManyAsync(texts, useHeader, returnExceptions, task, validate))
+
+def imagePromptMany(requests, returnExceptions = False, task = model_routing.DEFAULT):
+    return runSync(imagePromptManyAsync(requests, returnExceptions, task))
 
-    return stripJsonTag(response.text)
+# Fn: textPromptStream()
+# Brief: Yields the raw response text chunk by chunk, see streaming_json for parsing it as it arrives
+def textPromptStream(text, useHeader = True, task = model_routing.DEFAULT):
+    return runSyncStream(textPromptStreamAsync(text, useHeader, task))
 
-def imagePrompt(text, image):
-    response = getClient().models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[f"{getPromptHeader()} {text}", image])
-    return stripJsonTag(response.text)
+def imagePromptStream(text, image, mimeType = "image/jpeg", task = model_routing.DEFAULT):
+    return runSyncStream(imagePromptStreamAsync(text, image, mimeType, task))
 
 def getPromptHeader():
     global promptHeader
@@ -0,0 +1,38 @@
+import pandas as pd
+import streamlit as st
+from health_rollups import getDashboard
+
+def health_dashboard():
+    """Show the signed in user's precomputed rollup, one document read however long their history is"""
+    user = st.session_state.get("user")
+    if not user:
+        st.info("Log in to see your health dashboard")
+        return
+
+    dashboard = getDashboard(user.user_id)
+    if not dashboard["entries"] and not dashboard["healthRecords"]:
+        st.info("Nothing to show yet, scanned and added medications will appear here")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Active medications", len(dashboard["activeMedications"]))
+    col2.metric("Medications ever taken", dashboard["medicationCount"])
+    col3.metric("Health records", dashboard["healthRecords"])
+
+    st.subheader("Active medications")
+    if dashboard["activeMedications"]:
+        st.dataframe(pd.DataFrame([
+            {"Medication": med["name"], "Times added": med["count"], "Last added": med["last_added"]}
+            for med in dashboard["activeMedications"]
+        ]), hide_index=True)
+    else:
+        st.write("No medications added recently")
+
+    if dashboard["systems"]:
+        st.subheader("Body systems affected over time")
+        systems = pd.DataFrame(dashboard["systems"]).fillna(0).sort_index()
+        st.line_chart(systems)
+
+    if dashboard["negativeByRegion"]:
+        st.subheader("Negative effects by region")
+        st.bar_chart(pd.Series(dashboard["negativeByRegion"], name="Negative effects"))
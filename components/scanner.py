@@ -0,0 +1,86 @@
+import io
+import os
+import PIL.Image
+import streamlit as st
+from image_preprocess import getPreprocessor
+from scan_jobs import DONE, FAILED, MAX_IMAGE_BYTES, ScanJobQueue, ScanWorkerPool
+
+@st.cache_resource
+def start_embedded_workers():
+    """Start the in-process scan workers once per Streamlit server (SCAN_WORKERS=0 to rely on external workers)"""
+    workers = int(os.getenv("SCAN_WORKERS", "2"))
+    if workers <= 0:
+        return None
+    return ScanWorkerPool(workers).start()
+
+@st.cache_resource
+def get_job_queue():
+    return ScanJobQueue()
+
+def show_result(job):
+    """Render a finished (done or failed) job"""
+    if job["status"] == DONE:
+        st.success("Scan complete")
+        if job.get("medications"):
+            st.write("Medications found: " + ", ".join(job["medications"]))
+        st.text(job["result"])
+    else:
+        st.error(f"Scan failed: {job.get('error')}")
+
+@st.fragment(run_every=2)
+def scan_status():
+    """Poll the current job without rerunning the whole page, until it finishes"""
+    job_id = st.session_state.get("scan_job_id")
+    if not job_id:
+        return
+
+    job = get_job_queue().get(job_id)
+    if not job:
+        st.error("Scan job not found")
+        return
+
+    if job["status"] in (DONE, FAILED):
+        # Keep the result and rerun the page, which renders it without this fragment so polling stops
+        st.session_state.scan_job = job
+        st.rerun()
+    else:
+        attempt = f" (attempt {job['attempts']})" if job.get("attempts", 0) > 1 else ""
+        st.info(f"Scan {job['status']}{attempt}...")
+
+def upload_bytes(upload):
+    """The upload as submitted to the queue, shrunk with the scan preprocessor when it's over MAX_IMAGE_BYTES"""
+    data = upload.getvalue()
+    if len(data) <= MAX_IMAGE_BYTES:
+        return data
+    try:
+        return getPreprocessor().process(PIL.Image.open(io.BytesIO(data)), sourceBytes=len(data)).data
+    except OSError:
+        return None
+
+def prescription_scanner():
+    start_embedded_workers()
+
+    with st.form("scan_form"):
+        upload = st.file_uploader("Prescription or doctor's note", type=["png", "jpg", "jpeg"])
+        kind = st.radio("Document type", ["Prescription label", "Doctor's note"], horizontal=True)
+        language = st.selectbox("Translate note to", ["English", "French", "Vietnamese", "Chinese"])
+        submit = st.form_submit_button("Scan")
+
+        if submit and upload:
+            data = upload_bytes(upload)
+            if data is None:
+                st.error("That file couldn't be read as an image")
+            else:
+                st.session_state.scan_job_id = get_job_queue().submit(
+                    data,
+                    kind="doctorsNote" if kind == "Doctor's note" else "facts",
+                    language=language,
+                    userId=st.session_state.user.user_id if st.session_state.get("user") else None
+                )
+                st.session_state.scan_job = None
+
+    job = st.session_state.get("scan_job")
+    if job and str(job["_id"]) == st.session_state.get("scan_job_id"):
+        show_result(job)
+    else:
+        scan_status()
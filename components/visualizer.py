@@ -1,7 +1,11 @@
 import streamlit as st
 from drug_affection import DrugRegionParser
-import numpy as np
-import pandas as pd
+from render_service import getRenderService
+
+
+def current_theme():
+    return "dark" if st.get_option("theme.base") == "dark" else "light"
+
 
 def twod_visualizer():
     with st.form("visualize_form"):
@@ -12,13 +16,12 @@ def twod_visualizer():
             st.write(f"Effects of {drug_name}")
 
             parser = DrugRegionParser(drug_name)
-            # print(parser.findAffected())
             data = parser.findAffected()
-            # df = pd.DataFrame(
-            #     np.random.randn(10, 5), columns=['']
-            # )
 
-            for affections in data['affections']:
-                print(affections)
+            # Rendered in the service's worker processes and cached per drug, version and theme
+            image = getRenderService().render(data, theme=current_theme())
+            st.image(image, caption=data.get("name", drug_name))
 
-            # st.table(df)
\ No newline at end of file
+            for system, effects in data['affections'].items():
+                for effect in effects:
+                    st.write(f"**{system}** - {effect.get('name')} ({effect.get('responseType')})")
@@ -1,9 +1,84 @@
+import atexit
 import os
+import threading
 from pymongo import MongoClient
 from dotenv import load_dotenv
+import metrics
 
 load_dotenv()
 
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _client_options():
+    """Pool, timeout and monitoring settings, overridable through the environment"""
+    return {
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+        "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "20000")),
+        "heartbeatFrequencyMS": int(os.getenv("MONGODB_HEARTBEAT_MS", "10000")),
+        "appname": os.getenv("MONGODB_APP_NAME", "HealthLens"),
+    }
+
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use.
+
+    A client inherited through fork() is never reused: its sockets and monitor
+    threads belong to the parent, so the child builds its own.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+            _client = MongoClient(mongodb_uri, connect=False, event_listeners=metrics.mongoListeners(),
+                                  **_client_options())
+            _client_pid = pid
+    return _client
+
+
+def close_client():
+    """Close the shared client, e.g. on shutdown. The next get_client() call reconnects"""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _reset_after_fork():
+    # Don't close the parent's client from the child, just forget it
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+
+
+def health_check():
+    """Ping the server and report pool settings"""
+    options = _client_options()
+    try:
+        get_client().admin.command("ping")
+        return {"ok": True, "maxPoolSize": options["maxPoolSize"], "pid": os.getpid()}
+    except Exception as e:
+        return {"ok": False, "error": str(e), "pid": os.getpid()}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(close_client)
+
+
 class Database:
     def __init__(self):
         self.client = None
@@ -11,14 +86,16 @@ class Database:
         self.connect()
 
     def connect(self):
-        mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
         db_name = os.getenv("DB_NAME", "HealthLens")
 
         try:
-            self.client = MongoClient(mongodb_uri)
+            self.client = get_client()
             self.db = self.client[db_name]
         except Exception as e:
             print(f"Error connecting to MongoDB: {e}")
-    
+
     def get_collection(self, collection_name):
-        return self.db[collection_name]
\ No newline at end of file
+        return self.db[collection_name]
+
+    def ping(self):
+        return health_check()["ok"]
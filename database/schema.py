@@ -0,0 +1,207 @@
+import argparse
+import sys
+import threading
+import time
+from pymongo.errors import PyMongoError
+from database.db_connection import Database
+
+# Every index the app relies on, by collection. Keys are (field, direction) pairs as passed to
+# create_index; any other entry is an index option, except "dedupe", which lets a unique index remove
+# duplicate documents (keeping the oldest) before it's built. Only set it where duplicates are
+# interchangeable copies. Add new collections and indexes here rather than calling create_index from
+# request code.
+SCHEMA = {
+    "users": [
+        {"keys": [("email", 1)], "unique": True},
+    ],
+    "Drugs": [
+        {"keys": [("name", 1)], "unique": True, "dedupe": True}, # Racing generations stored copies before this index existed
+    ],
+    "DrugAliases": [
+        {"keys": [("alias", 1)], "unique": True, "dedupe": True},
+    ],
+    "ResponseCache": [
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "medication_history": [
+        {"keys": [("user_id", 1), ("added_at", -1), ("_id", -1)]}, # Matches UserHistory.page's sort, no in-memory sort
+    ],
+    "health_records": [
+        {"keys": [("user_id", 1), ("added_at", -1), ("_id", -1)]}, # Matches UserHistory.page's sort, no in-memory sort
+    ],
+    "ScanJobs": [
+        {"keys": [("status", 1), ("run_after", 1)]},
+        {"keys": [("finished_at", 1)], "expireAfterSeconds": 7 * 24 * 3600},
+    ],
+}
+
+# Options that change what an index does. Anything else the server reports (v, ns, ...) is ignored
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+RETRY_SECONDS = 60 # How long ensure_schema waits before trying again after a failure
+
+_ensured = False
+_retry_after = 0
+_ensure_lock = threading.Lock()
+
+
+def _normalize_keys(keys):
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys]
+
+
+def index_name(spec):
+    """The name the server gives an index by default, e.g. status_1_run_after_1"""
+    return spec.get("name") or "_".join(f"{field}_{direction}" for field, direction in spec["keys"])
+
+
+def _options(spec):
+    # expireAfterSeconds=0 is meaningful, so only None and an explicit False count as unset
+    return {option: spec[option] for option in COMPARED_OPTIONS
+            if spec.get(option) is not None and spec.get(option) is not False}
+
+
+def _server_indexes(collection):
+    indexes = {}
+    for name, info in collection.index_information().items():
+        if name == "_id_":
+            continue
+        indexes[name] = {"keys": _normalize_keys(info["key"]), **_options(info)}
+    return indexes
+
+
+def diff_schema(db):
+    """Compare SCHEMA with the server.
+
+    Returns a list of drift entries, each a dict with collection, index, status
+    ("missing", "changed" or "extra"), expected and actual.
+    """
+    drift = []
+    existing = set(db.list_collection_names())
+    for collection_name, specs in SCHEMA.items():
+        actual = _server_indexes(db[collection_name]) if collection_name in existing else {}
+        declared = set()
+        for spec in specs:
+            name = index_name(spec)
+            declared.add(name)
+            expected = {"keys": _normalize_keys(spec["keys"]), **_options(spec)}
+            if name not in actual:
+                drift.append({"collection": collection_name, "index": name, "status": "missing",
+                              "expected": expected, "actual": None})
+            elif actual[name] != expected:
+                drift.append({"collection": collection_name, "index": name, "status": "changed",
+                              "expected": expected, "actual": actual[name]})
+        for name in sorted(set(actual) - declared):
+            drift.append({"collection": collection_name, "index": name, "status": "extra",
+                          "expected": None, "actual": actual[name]})
+    return drift
+
+
+def dedupe(collection, keys):
+    """Delete documents that share the same values for keys, keeping the oldest of each group.
+    Returns the number deleted"""
+    fields = [field for field, _ in keys]
+    groups = collection.aggregate([
+        {"$group": {"_id": {field.replace(".", "_"): f"${field}" for field in fields},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    deleted = 0
+    for group in groups:
+        extra = sorted(group["ids"])[1:]
+        deleted += collection.delete_many({"_id": {"$in": extra}}).deleted_count
+    return deleted
+
+
+def _create(db, collection_name, name):
+    spec = next(spec for spec in SCHEMA[collection_name] if index_name(spec) == name)
+    options = {key: value for key, value in spec.items() if key not in ("keys", "name", "dedupe")}
+    if spec.get("dedupe") and spec.get("unique"):
+        dedupe(db[collection_name], spec["keys"])
+    db[collection_name].create_index(spec["keys"], name=name, **options)
+
+
+def apply_schema(db, drop_changed=False, drop_extra=False):
+    """Create missing indexes. Changed and undeclared indexes are only reported unless asked to drop them,
+    since rebuilding a large index is something to schedule, not do on startup.
+
+    Returns the drift entries with an "action" of created, rebuilt, dropped, reported or failed (with the
+    "error"). One index failing doesn't stop the others.
+    """
+    drift = diff_schema(db)
+    for entry in drift:
+        collection = db[entry["collection"]]
+        try:
+            if entry["status"] == "missing":
+                _create(db, entry["collection"], entry["index"])
+                entry["action"] = "created"
+            elif entry["status"] == "changed" and drop_changed:
+                collection.drop_index(entry["index"])
+                _create(db, entry["collection"], entry["index"])
+                entry["action"] = "rebuilt"
+            elif entry["status"] == "extra" and drop_extra:
+                collection.drop_index(entry["index"])
+                entry["action"] = "dropped"
+            else:
+                entry["action"] = "reported"
+        except PyMongoError as e:
+            entry["action"] = "failed"
+            entry["error"] = str(e)
+    return drift
+
+
+def ensure_schema():
+    """Apply the schema once per process. Call at startup, never per request.
+    After a failure it's tried again on a call at least RETRY_SECONDS later"""
+    global _ensured, _retry_after
+    if _ensured or time.monotonic() < _retry_after:
+        return
+    with _ensure_lock:
+        if _ensured or time.monotonic() < _retry_after:
+            return
+        ok = True
+        try:
+            for entry in apply_schema(Database().db):
+                if entry["action"] == "reported":
+                    print(f"Schema drift: {entry['collection']}.{entry['index']} is {entry['status']}, "
+                          f"run `python -m database.schema` to review")
+                elif entry["action"] == "failed":
+                    ok = False
+                    print(f"Schema drift: could not create {entry['collection']}.{entry['index']}: {entry['error']}")
+        except PyMongoError as e:
+            ok = False
+            print(f"Could not apply database schema: {e}")
+        if ok:
+            _ensured = True
+        else:
+            # Not on every rerun while Mongo is down, but not never either
+            _retry_after = time.monotonic() + RETRY_SECONDS
+
+
+def format_entry(entry):
+    line = f"{entry.get('action', entry['status']):>9}  {entry['collection']}.{entry['index']} ({entry['status']})"
+    if entry["status"] == "changed":
+        line += f"\n           expected {entry['expected']}\n           actual   {entry['actual']}"
+    if entry.get("error"):
+        line += f"\n           error    {entry['error']}"
+    return line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create declared MongoDB indexes and report drift")
+    parser.add_argument("--check", action="store_true", help="Only report drift, exit 1 if there is any")
+    parser.add_argument("--drop-changed", action="store_true", help="Rebuild indexes whose options differ")
+    parser.add_argument("--drop-extra", action="store_true", help="Drop indexes that aren't declared")
+    args = parser.parse_args()
+
+    db = Database().db
+    if args.check:
+        entries = diff_schema(db)
+    else:
+        entries = apply_schema(db, drop_changed=args.drop_changed, drop_extra=args.drop_extra)
+
+    for entry in entries:
+        print(format_entry(entry))
+    if not entries:
+        print("Schema is up to date")
+    failed = any(entry.get("action") == "failed" for entry in entries)
+    sys.exit(1 if failed or (args.check and entries) else 0)
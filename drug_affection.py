@@ -1,113 +1,392 @@
+import contextvars
 import json
-from client import textPrompt
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from client import textPrompt, textPromptMany
 from database.db_connection import Database
+from drug_names import normalizeDrugName
+import metrics
+import model_routing
 
-class DrugRegionParser:
-    def __init__(self, drugName: str):
-        self.drugName = drugName
-
-    # Fn: prompt()
-    # Brief: Prompts the language model for the regions and afflication types for the drug
-    def prompt(self):
-        req = f"""
-        You are a medical information specialist tasked with analyzing and describing the effects of a specific drug on the human body. Your goal is to provide a structured JSON response containing clear, accurate information about the drug's common effects at regular dosages.
+# Generations currently running in this process, keyed by normalized drug name
+inflight = dict()
+inflightLock = threading.Lock()
+DUPLICATE_KEY = 11000
+MAX_BATCH = 5 # Drugs per batched request, keeps the response well inside the output token limit
 
-        Here is the name of the drug you need to analyze:
-
-        <drug_name>
-        {self.drugName}
-        </drug_name>
-
-        Follow these guidelines for your analysis and final JSON response:
-
-        1. Focus only on common effects that occur at regular dosages. Exclude rare side effects or effects from high dosages.
+# Shared by the single and batched prompts
+GUIDELINES = """        1. Focus only on common effects that occur at regular dosages. Exclude rare side effects or effects from high dosages.
         2. Include information for a body system only if there are notable effects. Omit systems not significantly affected.
         3. Use language that is easily understandable for the average person.
         4. For the brain, try to only pick the most notable regions
-        5. Use "POSITIVE" for beneficial effects and "NEGATIVE" for adverse effects.
+        5. Use "POSITIVE" for beneficial effects and "NEGATIVE" for adverse effects."""
 
-        After your analysis, generate a JSON response using the following structure:
-
-        {{
+AFFECTION_STRUCTURE = """        {
+          "genericName": "[Generic (non-brand) name of the drug]",
           "brain": [
-            {{
+            {
               "name": "[Name of affected brain region]",
               "responseType": "[POSITIVE or NEGATIVE]",
               "responseDescription": "[Clear description of the effect]"
-            }}
+            }
           ],
           "muscular": [
-            {{
+            {
               "name": "[Name of affected muscle or muscle group]",
               "responseType": "[POSITIVE or NEGATIVE]",
               "responseDescription": "[Clear description of the effect]"
-            }}
+            }
           ],
           "skeletal": [
-            {{
+            {
               "name": "[Name of affected bone or bone group]",
               "responseType": "[POSITIVE or NEGATIVE]",
               "responseDescription": "[Clear description of the effect]"
-            }}
+            }
           ],
           "organs": [
-            {{
+            {
               "name": "[Name of affected organ]",
               "responseType": "[POSITIVE or NEGATIVE]",
               "responseDescription": "[Clear description of the effect]"
-            }}
+            }
           ]
-        }}
+        }"""
+
+SYSTEMS = ("brain", "muscular", "skeletal", "organs")
+RESPONSE_TYPES = ("POSITIVE", "NEGATIVE")
+
+# Fn: validateAffections()
+# Brief: Checks a model response for one drug has the shape the visualizer expects. Top-level keys
+#        other than the body systems and genericName are dropped, everything reading affections assumes
+#        each value is a list of effects
+# Rets: dict - The affections, raises ValueError if they're malformed
+def validateAffections(affections):
+    if not isinstance(affections, dict):
+        raise ValueError("Expected an object of body systems")
+    for system in SYSTEMS:
+        effects = affections.get(system, [])
+        if not isinstance(effects, list):
+            raise ValueError(f"{system} should be a list")
+        for effect in effects:
+            if not isinstance(effect, dict) or not isinstance(effect.get("name"), str):
+                raise ValueError(f"{system} has an effect without a name")
+            if effect.get("responseType") not in RESPONSE_TYPES:
+                raise ValueError(f"{system} has an unknown responseType {effect.get('responseType')!r}")
+    cleaned = {system: affections[system] for system in SYSTEMS if system in affections}
+    if isinstance(affections.get("genericName"), str):
+        cleaned["genericName"] = affections["genericName"]
+    return cleaned
+
+# Fn: checkResponse()
+# Brief: Validator for textPrompt, so a response buildDrug would reject never makes it into the response cache
+def checkResponse(text):
+    validateAffections(json.loads(text))
+
+# Fn: checkBatchResponse()
+# Brief: Same for batchPrompt responses. Drugs missing from an otherwise valid batch fall back on their own
+def checkBatchResponse(text):
+    if not isinstance(json.loads(text), dict):
+        raise ValueError("Expected an object keyed by drug name")
+
+class DrugRegionParser:
+    def __init__(self, drugName: str):
+        self.drugName = drugName
+        self.normalizedName = normalizeDrugName(drugName)
+
+    # Fn: prompt()
+    # Brief: Prompts the language model for the regions and afflication types for the drug
+    def prompt(self):
+        req = f"""
+        You are a medical information specialist tasked with analyzing and describing the effects of a specific drug on the human body. Your goal is to provide a structured JSON response containing clear, accurate information about the drug's common effects at regular dosages.
+
+        Here is the name of the drug you need to analyze:
+
+        <drug_name>
+        {self.drugName}
+        </drug_name>
+
+        Follow these guidelines for your analysis and final JSON response:
+
+{GUIDELINES}
+
+        After your analysis, generate a JSON response using the following structure:
+
+{AFFECTION_STRUCTURE}
 
         Important: Your final output must be valid JSON only, with no additional text or explanations outside the JSON structure. Ensure all descriptions are clear and easily understandable for non-medical professionals.
 
         Please proceed with your analysis and JSON response for the drug specified.    
         """
 
-        data = textPrompt(req, False)
+        data = textPrompt(req, False, task=model_routing.DRUG_EFFECTS, validate=checkResponse)
         return data
 
     # Fn: query()
-    # Brief: Queries the db for the drug
+    # Brief: Queries the db for the drug, resolving brand names and spelling variants through DrugAliases
     # Rets: The data or None if it wasn't found
     def query(self):
         db = Database().db
         drugs = db['Drugs']
 
-        drug = drugs.find_one({"name": self.drugName})
+        name = self.normalizedName
+        alias = db['DrugAliases'].find_one({"alias": name}, {"name": 1})
+        if alias:
+            name = alias["name"]
+
+        drug = drugs.find_one({"name": name})
         return drug
 
+    # Fn: learnAliases()
+    # Brief: Points every alias at the canonical drug name so later lookups of a brand or generic name hit
+    def learnAliases(self, aliases, canonicalName):
+        db = Database().db
+
+        for alias in set(aliases):
+            if not alias:
+                continue
+            try:
+                db['DrugAliases'].update_one(
+                    {"alias": alias},
+                    {"$setOnInsert": {"alias": alias, "name": canonicalName}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                pass # Another process learned the same alias first
+
     # Fn: addDrug()
-    # Brief: Adds the drug into mongo
+    # Brief: Upserts the drug into mongo. If another process already stored it, that document wins
+    # Rets: The stored document
     def addDrug(self, data):
         db = Database().db
         drugs = db['Drugs']
-        res = drugs.insert_one(data)
-        data['_id'] = res.inserted_id
 
-        # Now fetch the drug
-        return data
+        try:
+            return drugs.find_one_and_update(
+                {"name": data["name"]},
+                {"$setOnInsert": data},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Two upserts raced on the unique index, the other one inserted first
+            return drugs.find_one({"name": data["name"]})
 
     def setDrugName(self, drugName):
         self.drugName = drugName
+        self.normalizedName = normalizeDrugName(drugName)
+
+    # Fn: buildDrug()
+    # Brief: Turns the model response into a Drugs document, keyed by the normalized generic name when the model reports one
+    # Rets: dict - The document and the generic name the model reported (or None)
+    def buildDrug(self, promptData):
+        with metrics.span("drug.parse"):
+            affections = json.loads(promptData) if isinstance(promptData, str) else promptData
+            affections = validateAffections(affections)
+        genericName = normalizeDrugName(affections.pop("genericName", None))
+        newData = {
+            "name": genericName or self.normalizedName,
+            "form": None,
+            "affections": affections,
+            "version": 1 # Bump when affections change, rendered diagrams are cached per version
+        }
+        return newData, genericName
+
+    # Fn: generate()
+    # Brief: Prompts for the drug, stores the result and learns the aliases that lead to it
+    def generate(self):
+        with metrics.span("drug.prompt"):
+            response = self.prompt()
+        newData, genericName = self.buildDrug(response)
+        with metrics.span("drug.store"):
+            data = self.addDrug(newData)
+            self.learnAliases([self.normalizedName, genericName], data["name"])
+        return data
 
     # Fn findAffected()
-    # Brief: Check if the name of the drug already exists in the db, else prompt for it
+    # Brief: Check if the name of the drug already exists in the db, else prompt for it.
+    #        Concurrent misses for the same drug wait on a single generation instead of each prompting.
     # Rets: str - The json of the affected regions in this format { brain: [], muscular: [], skeletal: [], organs: [] }
     def findAffected(self):
         # 1. Query for data
-        data = self.query()
-
-        # 2. If drug doesn't exist, then prompt for it
-        if not data:
-            promptData = self.prompt()
-            newData = {
-                "name": self.drugName,
-                "form": None,
-                "affections": json.loads(promptData)
-            }
-            data = self.addDrug(newData)
-        return data
+        with metrics.span("drug.query") as span:
+            data = self.query()
+            span.set(drug=self.normalizedName, found=bool(data))
+        if data:
+            return data
+
+        # 2. If drug doesn't exist, then prompt for it (unless someone else already is)
+        with inflightLock:
+            future = inflight.get(self.normalizedName)
+            leader = future is None
+            if leader:
+                future = Future()
+                inflight[self.normalizedName] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            # A leader that finished just before we claimed may already have stored it
+            data = self.query() or self.generate()
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with inflightLock:
+                inflight.pop(self.normalizedName, None)
+
+# Fn: batchPrompt()
+# Brief: Prompts for several drugs at once, the response is keyed by the names given
+def batchPrompt(drugNames):
+    names = "\n".join(drugNames)
+    req = f"""
+        You are a medical information specialist tasked with analyzing and describing the effects of several drugs on the human body. Your goal is to provide a structured JSON response containing clear, accurate information about each drug's common effects at regular dosages.
+
+        Here are the names of the drugs you need to analyze, one per line:
+
+        <drug_names>
+{names}
+        </drug_names>
+
+        Follow these guidelines for your analysis of each drug:
+
+{GUIDELINES}
+
+        Generate a single JSON object with one key per drug, using the drug name exactly as written above as the key. The value for each drug uses the following structure:
+
+{AFFECTION_STRUCTURE}
+
+        Important: Your final output must be valid JSON only, with no additional text or explanations outside the JSON structure. Ensure all descriptions are clear and easily understandable for non-medical professionals.
+        """
+    return req
+
+# Fn: queryMany()
+# Brief: Looks up several normalized names with two queries instead of two per drug
+# Rets: dict - normalized name -> stored document, for the names that were found
+def queryMany(normalizedNames):
+    db = Database().db
+    aliases = {doc["alias"]: doc["name"] for doc in db['DrugAliases'].find({"alias": {"$in": list(normalizedNames)}}, {"alias": 1, "name": 1})}
+    lookup = set(normalizedNames) | set(aliases.values())
+    stored = {doc["name"]: doc for doc in db['Drugs'].find({"name": {"$in": list(lookup)}})}
+
+    found = dict()
+    for name in normalizedNames:
+        doc = stored.get(aliases.get(name, name)) or stored.get(name)
+        if doc:
+            found[name] = doc
+    return found
+
+# Fn: storeDrugs()
+# Brief: Upserts generated drugs and their aliases with one bulk_write per collection
+# Args: batch - list of (normalized requested name, drug document, generic name or None)
+def storeDrugs(batch):
+    if not batch:
+        return
+
+    db = Database().db
+
+    drugOps = [UpdateOne({"name": doc["name"]}, {"$setOnInsert": doc}, upsert=True) for _, doc, _ in batch]
+    aliasOps = []
+    for normalized, doc, genericName in batch:
+        for alias in {normalized, genericName}:
+            if alias:
+                aliasOps.append(UpdateOne({"alias": alias}, {"$setOnInsert": {"alias": alias, "name": doc["name"]}}, upsert=True))
+
+    for collection, ops in ((db['Drugs'], drugOps), (db['DrugAliases'], aliasOps)):
+        try:
+            collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Upsert races on the unique indexes mean someone else stored it, anything else is real
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+            if errors:
+                raise
+
+# Fn: findAffectedMany()
+# Brief: findAffected() for a whole prescription. Misses are generated MAX_BATCH drugs per request,
+#        and any drug the batched response got wrong falls back to its own findAffected() call.
+# Rets: dict - requested name -> drug document, in the order the names were given
+def findAffectedMany(drugNames):
+    parsers = {name: DrugRegionParser(name) for name in drugNames}
+    byNormalized = dict()
+    for parser in parsers.values():
+        if parser.normalizedName:
+            byNormalized.setdefault(parser.normalizedName, parser)
+
+    found = queryMany(list(byNormalized))
+
+    # Claim the misses no one else in this process is already generating
+    owned, waiting = [], dict()
+    with inflightLock:
+        for name in byNormalized:
+            if name in found:
+                continue
+            if name in inflight:
+                waiting[name] = inflight[name]
+            else:
+                inflight[name] = Future()
+                owned.append(name)
+
+    fallback = []
+    try:
+        chunks = [owned[i:i + MAX_BATCH] for i in range(0, len(owned), MAX_BATCH)]
+        requests = [batchPrompt([byNormalized[name].drugName for name in chunk]) for chunk in chunks]
+        responses = textPromptMany(requests, False, returnExceptions=True, task=model_routing.DRUG_EFFECTS_BATCH, validate=checkBatchResponse) if len(owned) > 1 else []
+
+        generated = []
+        for chunk, response in zip(chunks, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise ValueError(str(response))
+                entries = json.loads(response)
+                entries = {normalizeDrugName(key): value for key, value in entries.items()}
+            except (ValueError, AttributeError):
+                entries = dict() # Whole chunk failed, every drug in it falls back
+
+            for name in chunk:
+                try:
+                    newData, genericName = byNormalized[name].buildDrug(entries[name])
+                    generated.append((name, newData, genericName))
+                except (KeyError, TypeError, ValueError):
+                    fallback.append(name)
+        if len(owned) == 1:
+            fallback.extend(owned)
+
+        storeDrugs(generated)
+        stored = queryMany([name for name, _, _ in generated])
+        for name, _, _ in generated:
+            if name in stored:
+                found[name] = stored[name]
+                inflight[name].set_result(stored[name])
+            else:
+                fallback.append(name)
+
+        # Anything the batch didn't cover gets its own request, still under this call's claim. Each runs in a
+        # copy of the caller's context so it keeps the caller's llm_limiter lane
+        contexts = [contextvars.copy_context() for _ in fallback]
+        with ThreadPoolExecutor(max_workers=min(len(fallback), MAX_BATCH) or 1) as pool:
+            generated = pool.map(lambda name, context: context.run(byNormalized[name].generate), fallback, contexts)
+            for name, data in zip(fallback, generated):
+                found[name] = data
+                inflight[name].set_result(data)
+    except BaseException as e:
+        for name in owned:
+            if not inflight[name].done():
+                inflight[name].set_exception(e)
+        raise
+    finally:
+        with inflightLock:
+            for name in owned:
+                inflight.pop(name, None)
+
+    for name, future in waiting.items():
+        found[name] = future.result()
+
+    return {name: found.get(parser.normalizedName) for name, parser in parsers.items()}
 
 if __name__ == "__main__":
     regionParser = DrugRegionParser("advil")
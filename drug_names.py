@@ -0,0 +1,61 @@
+import re
+import unicodedata
+
+# Strengths such as "10mg", "0.5 %", "250 mg/5 ml", "100 units"
+STRENGTH_PATTERN = re.compile(
+    r"\b\d+(?:[.,]\d+)?\s*(?:mg|mcg|µg|ug|g|kg|ml|l|iu|units?|meq|mmol|%)"
+    r"(?:\s*/\s*\d*(?:[.,]\d+)?\s*(?:ml|l|g|tab|tablet|dose|hr|h|actuation))?(?=\W|$)"
+)
+# Anything in brackets, e.g. "Tylenol (acetaminophen)"
+BRACKETS_PATTERN = re.compile(r"[\(\[\{][^\)\]\}]*[\)\]\}]")
+NUMBER_PATTERN = re.compile(r"\b\d+(?:[.,]\d+)?\b")
+
+DOSAGE_FORMS = {
+    "tablet", "tablets", "tab", "tabs", "capsule", "capsules", "cap", "caps", "caplet", "caplets",
+    "oral", "solution", "suspension", "syrup", "injection", "injectable", "cream", "ointment", "gel",
+    "patch", "drops", "spray", "inhaler", "chewable", "softgel", "softgels", "liquid", "powder",
+    "er", "xr", "sr", "cr", "xl", "dr", "ec", "odt", "extended", "delayed", "release", "immediate"
+}
+
+# Metals that name a drug together with an anion ("calcium carbonate", "ferrous sulfate"), and are
+# only a counter-ion when they follow a base drug ("losartan potassium")
+CATIONS = {
+    "sodium", "potassium", "calcium", "magnesium", "lithium", "zinc", "ferrous", "ferric", "iron",
+    "aluminum", "aluminium", "ammonium"
+}
+
+SALT_FORMS = CATIONS | {
+    "hydrochloride", "hcl", "hydrobromide", "hbr",
+    "sulfate", "sulphate", "maleate", "mesylate", "besylate", "tartrate", "bitartrate", "succinate",
+    "citrate", "phosphate", "acetate", "fumarate", "bromide", "chloride", "nitrate", "lactate",
+    "monohydrate", "dihydrate", "trihydrate", "anhydrous", "dipropionate", "propionate", "valerate"
+}
+
+
+# Fn: normalizeDrugName()
+# Brief: Reduces a user or model supplied drug name to the form used as the Drugs cache key.
+#        "ADVIL 200mg tablets " and "advil" both become "advil"; "Metformin HCl ER" becomes "metformin"
+# Rets: str - The normalized name, or "" if nothing usable was given
+def normalizeDrugName(name):
+    if not name:
+        return ""
+
+    text = unicodedata.normalize("NFKC", str(name)).casefold()
+    text = BRACKETS_PATTERN.sub(" ", text)
+    text = STRENGTH_PATTERN.sub(" ", text)
+    text = NUMBER_PATTERN.sub(" ", text)
+    text = re.sub(r"[^\w\s-]", " ", text)
+    tokens = [token.strip("-") for token in text.split()]
+    tokens = [token for token in tokens if token and token not in DOSAGE_FORMS]
+
+    # Only drop salt words that follow a base drug. "Potassium chloride" and "calcium carbonate" are
+    # drugs on their own and must not collapse onto "chloride" or "carbonate"
+    kept = []
+    hasBase = False
+    for token in tokens:
+        if hasBase and token in SALT_FORMS:
+            continue
+        hasBase = hasBase or token not in SALT_FORMS
+        kept.append(token)
+
+    return " ".join(kept)
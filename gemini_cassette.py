@@ -0,0 +1,227 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from response_cache import imageDigest
+
+load_dotenv()
+
+# GEMINI_TRANSPORT picks where model calls go:
+#   live   - the Gemini API (default)
+#   record - the Gemini API, appending every request and response to GEMINI_CASSETTE
+#   replay - answered from GEMINI_CASSETTE without network or quota
+# Replay sleeps for each response's recorded latency times GEMINI_REPLAY_LATENCY_SCALE (0 for instant).
+# A request missing from the cassette raises CassetteMiss, or goes live with GEMINI_REPLAY_MISS=live.
+# Record with RESPONSE_CACHE_ENABLED=0, a cached response never reaches the transport.
+TRANSPORT = os.environ.get("GEMINI_TRANSPORT", "live").strip().lower()
+CASSETTE_PATH = os.environ.get("GEMINI_CASSETTE", "gemini_cassette.jsonl.gz")
+LATENCY_SCALE = float(os.environ.get("GEMINI_REPLAY_LATENCY_SCALE", "1.0"))
+REPLAY_MISS = os.environ.get("GEMINI_REPLAY_MISS", "error").strip().lower()
+PROMPT_PREVIEW = 200 # Characters of the prompt kept for reading the cassette, the key identifies the request
+
+cassettes = dict()
+cassettesLock = threading.Lock()
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+# Fn: requestKey()
+# Brief: Identifies a request by model, prompt text and image contents
+# Rets: tuple - (key, prompt text, image digests)
+def requestKey(model, contents):
+    texts, images = [], []
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, str):
+            texts.append(part)
+            continue
+        inline = getattr(part, "inline_data", None)
+        if inline is not None:
+            images.append(imageDigest(inline.data))
+        elif hasattr(part, "tobytes"): # PIL image
+            images.append(imageDigest(part))
+        elif getattr(part, "text", None):
+            texts.append(part.text)
+
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0t" + text.encode("utf-8"))
+    for image in images:
+        digest.update(b"\0i" + image.encode("utf-8"))
+    return digest.hexdigest(), "\n".join(texts), images
+
+
+def usageOf(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {"prompt": getattr(usage, "prompt_token_count", None), "response": getattr(usage, "candidates_token_count", None)}
+
+
+# A cassette file: one JSON object per line, gzipped when the path ends in .gz. Appends are safe to
+# interleave from several threads; several recordings of the same request are replayed in turn.
+class Cassette:
+    def __init__(self, path):
+        self.path = path
+        self.records = dict() # key -> list of records
+        self.turns = dict() # key -> index of the next record to replay
+        self.lock = threading.Lock()
+        self.load()
+
+    def open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with self.open("r") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records.setdefault(record["key"], []).append(record)
+
+    def append(self, record):
+        with self.lock:
+            self.records.setdefault(record["key"], []).append(record)
+            with self.open("a") as f: # gzip appends a new member, gzip.open reads them all back
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def next(self, key):
+        with self.lock:
+            records = self.records.get(key)
+            if not records:
+                return None
+            turn = self.turns.get(key, 0)
+            self.turns[key] = turn + 1
+            return records[turn % len(records)]
+
+    def __len__(self):
+        return sum(len(records) for records in self.records.values())
+
+
+def getCassette(path=None):
+    path = path or CASSETTE_PATH
+    with cassettesLock:
+        if path not in cassettes:
+            cassettes[path] = Cassette(path)
+        return cassettes[path]
+
+
+def makeRecord(key, model, prompt, images, text, latency, usage, chunks=None):
+    record = {
+        "key": key,
+        "model": model,
+        "prompt": prompt[:PROMPT_PREVIEW],
+        "images": images,
+        "text": text,
+        "latency": round(latency, 4),
+        "usage": usage,
+        "recorded_at": datetime.now(timezone.utc).isoformat()
+    }
+    if chunks is not None:
+        record["chunks"] = chunks # [seconds since the request, text] per streamed chunk
+    return record
+
+
+# Stands in for client.aio.models, passing calls to the live API and recording them
+class RecordingModels:
+    def __init__(self, live, cassette):
+        self.live = live
+        self.cassette = cassette
+
+    async def generate_content(self, model, contents, **kwargs):
+        key, prompt, images = requestKey(model, contents)
+        start = time.perf_counter()
+        response = await self.live.generate_content(model=model, contents=contents, **kwargs)
+        self.cassette.append(makeRecord(key, model, prompt, images, response.text,
+                                        time.perf_counter() - start, usageOf(response)))
+        return response
+
+    async def generate_content_stream(self, model, contents, **kwargs):
+        key, prompt, images = requestKey(model, contents)
+        start = time.perf_counter()
+        stream = await self.live.generate_content_stream(model=model, contents=contents, **kwargs)
+
+        async def recorded():
+            chunks = []
+            chunk = None
+            async for chunk in stream:
+                chunks.append([round(time.perf_counter() - start, 4), chunk.text or ""])
+                yield chunk
+            text = "".join(text for _, text in chunks)
+            self.cassette.append(makeRecord(key, model, prompt, images, text,
+                                            time.perf_counter() - start, usageOf(chunk), chunks))
+        return recorded()
+
+
+# Stands in for client.aio.models, answering from a cassette
+class ReplayModels:
+    def __init__(self, cassette, latencyScale=1.0, live=None):
+        self.cassette = cassette
+        self.latencyScale = latencyScale
+        self.live = live # Called for requests the cassette doesn't have, None to raise CassetteMiss
+
+    def lookup(self, model, contents):
+        key, prompt, _ = requestKey(model, contents)
+        record = self.cassette.next(key)
+        if record is None and self.live is None:
+            raise CassetteMiss(f"No recording for {model} request: {prompt[:80]!r}")
+        return record
+
+    @staticmethod
+    def response(text, usage):
+        usage = usage or {}
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+            prompt_token_count=usage.get("prompt"), candidates_token_count=usage.get("response")))
+
+    async def generate_content(self, model, contents, **kwargs):
+        record = self.lookup(model, contents)
+        if record is None:
+            return await self.live().generate_content(model=model, contents=contents, **kwargs)
+        await asyncio.sleep(record["latency"] * self.latencyScale)
+        return self.response(record["text"], record.get("usage"))
+
+    async def generate_content_stream(self, model, contents, **kwargs):
+        record = self.lookup(model, contents)
+        if record is None:
+            return await self.live().generate_content_stream(model=model, contents=contents, **kwargs)
+
+        chunks = record.get("chunks") or [[record["latency"], record["text"]]]
+
+        async def replayed():
+            elapsed = 0.0
+            for i, (offset, text) in enumerate(chunks):
+                await asyncio.sleep(max(0.0, offset - elapsed) * self.latencyScale)
+                elapsed = offset
+                yield self.response(text, record.get("usage") if i == len(chunks) - 1 else None)
+        return replayed()
+
+
+# Fn: wrapAsyncClient()
+# Brief: Applies GEMINI_TRANSPORT to an async client factory
+# Args: makeLive - builds the live client.aio, only called if the transport needs it
+# Rets: An object with .models, used exactly like client.aio
+def wrapAsyncClient(makeLive):
+    if TRANSPORT == "record":
+        return SimpleNamespace(models=RecordingModels(makeLive().models, getCassette()))
+    if TRANSPORT == "replay":
+        live = None
+        if REPLAY_MISS == "live":
+            liveModels = []
+            def live():
+                if not liveModels:
+                    liveModels.append(makeLive().models)
+                return liveModels[0]
+        return SimpleNamespace(models=ReplayModels(getCassette(), LATENCY_SCALE, live))
+    if TRANSPORT != "live":
+        raise ValueError(f"Unknown GEMINI_TRANSPORT {TRANSPORT}, expected live, record or replay")
+    return makeLive()
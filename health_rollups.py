@@ -0,0 +1,224 @@
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from database.db_connection import Database
+from drug_names import normalizeDrugName
+from body_regions import resolveRegion
+
+ROLLUPS = "HealthRollups"
+ACTIVE_DAYS = 90 # A medication added within this many days counts as active
+
+# One rollup document per user, kept current on every history write so the dashboard is a single
+# _id lookup no matter how long the history is:
+# {
+#   "_id": user_id,
+#   "medications": {drug: {"name", "count", "first_added", "last_added"}},
+#   "entries": int,
+#   "systems": {system: {"YYYY-MM": entries affecting it}},
+#   "negativeByRegion": {region: NEGATIVE effects},
+#   "healthRecords": int,
+#   "updated_at": datetime
+# }
+# Map keys are normalized drug names, body systems and region names, none of which contain "." or "$".
+
+
+# Fn: drugSummary()
+# Brief: Boils a drug's affections down to what the rollups count
+# Rets: dict - {"version", "systems": [systems with effects], "negative": {region: NEGATIVE effects}}
+def drugSummary(drug):
+    negative = Counter()
+    systems = []
+    for system, effects in (drug.get("affections") or {}).items():
+        if not effects:
+            continue
+        systems.append(system)
+        for effect in effects:
+            region = resolveRegion(system, effect.get("name"))
+            if region and effect.get("responseType") == "NEGATIVE":
+                negative[region] += 1
+    return {"version": drug.get("version", 1), "systems": systems, "negative": dict(negative)}
+
+
+# Fn: backfillSummaries()
+# Brief: Stores drugSummary on Drugs documents that lack one or whose affections changed version since
+# Rets: int - Number of drugs updated
+def backfillSummaries():
+    drugs = Database().db['Drugs']
+    stale = {"$or": [
+        {"summary": {"$exists": False}},
+        {"$expr": {"$ne": ["$summary.version", {"$ifNull": ["$version", 1]}]}}
+    ]}
+    updated = 0
+    for drug in drugs.find(stale, {"affections": 1, "version": 1}):
+        drugs.update_one({"_id": drug["_id"]}, {"$set": {"summary": drugSummary(drug)}})
+        updated += 1
+    return updated
+
+
+# Fn: prepareMedications()
+# Brief: Adds the normalized drug name to new medication entries before they're stored, so the
+#        recompute pipeline can join them to Drugs
+def prepareMedications(entries):
+    for entry in entries:
+        entry["drug"] = normalizeDrugName(entry.get("name"))
+    return entries
+
+
+# Fn: backfillDrugNames()
+# Brief: Sets the normalized drug name on stored entries that predate prepareMedications (e.g. migrated ones)
+def backfillDrugNames(match, batchSize=500):
+    history = Database().db['medication_history']
+    ops = []
+    for entry in history.find(dict(match, drug={"$exists": False}), {"name": 1}):
+        ops.append(UpdateOne({"_id": entry["_id"]}, {"$set": {"drug": normalizeDrugName(entry.get("name"))}}))
+        if len(ops) >= batchSize:
+            history.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        history.bulk_write(ops, ordered=False)
+
+
+# Fn: recordHistory()
+# Brief: Folds newly stored history entries into the user's rollup with a single upsert
+def recordHistory(userId, medications, healthRecords=0):
+    medications = [entry for entry in medications if entry.get("drug")]
+    if not medications and not healthRecords:
+        return
+
+    from drug_affection import queryMany # Imported here, it pulls in the model client
+
+    drugs = queryMany(list({entry["drug"] for entry in medications})) if medications else {}
+    inc = Counter({"entries": len(medications), "healthRecords": healthRecords})
+    earliest, latest, names = {}, {}, {}
+    for entry in medications:
+        drug = drugs.get(entry["drug"])
+        key = drug["name"] if drug else entry["drug"] # Brand and generic spellings roll up together
+        addedAt = entry.get("added_at") or datetime.now()
+        inc[f"medications.{key}.count"] += 1
+        earliest[f"medications.{key}.first_added"] = min(addedAt, earliest.get(f"medications.{key}.first_added", addedAt))
+        latest[f"medications.{key}.last_added"] = max(addedAt, latest.get(f"medications.{key}.last_added", addedAt))
+        names[f"medications.{key}.name"] = entry.get("name")
+
+        if drug is None:
+            continue # Not generated yet, recompute() picks its effects up later
+        summary = drug.get("summary") or drugSummary(drug)
+        month = addedAt.strftime("%Y-%m")
+        for system in summary["systems"]:
+            inc[f"systems.{system}.{month}"] += 1
+        for region, count in summary["negative"].items():
+            inc[f"negativeByRegion.{region}"] += count
+
+    update = {"$inc": dict(inc), "$set": dict(names, updated_at=datetime.now())}
+    if earliest:
+        update["$min"] = earliest
+        update["$max"] = latest
+    Database().db[ROLLUPS].update_one({"_id": userId}, update, upsert=True)
+
+
+def joinDrugs():
+    """Pipeline stages resolving each history entry's drug through DrugAliases to its Drugs summary"""
+    return [
+        {"$lookup": {"from": "DrugAliases", "localField": "drug", "foreignField": "alias", "as": "alias"}},
+        {"$set": {"canonical": {"$ifNull": [{"$arrayElemAt": ["$alias.name", 0]}, "$drug"]}}},
+        {"$lookup": {"from": "Drugs", "localField": "canonical", "foreignField": "name", "as": "doc"}},
+        {"$set": {"summary": {"$arrayElemAt": ["$doc.summary", 0]},
+                  "month": {"$dateToString": {"format": "%Y-%m", "date": "$added_at"}}}},
+        {"$project": {"alias": 0, "doc": 0}}
+    ]
+
+
+def mergeInto(whenMatched):
+    return {"$merge": {"into": ROLLUPS, "on": "_id", "whenMatched": whenMatched, "whenNotMatched": "insert"}}
+
+
+# Fn: rollupPipelines()
+# Brief: The aggregation pipelines that rebuild rollups from the history collections, in run order.
+#        The first replaces each user's rollup, the rest merge their field into it.
+# Rets: list - (collection name, pipeline) pairs
+def rollupPipelines(match):
+    medications = [
+        {"$match": dict(match, drug={"$nin": [None, ""]})},
+        {"$sort": {"added_at": 1}}, # So $last picks the latest spelling
+        *joinDrugs(),
+        {"$group": {"_id": {"user": "$user_id", "drug": "$canonical"}, "name": {"$last": "$name"},
+                    "count": {"$sum": 1}, "first_added": {"$min": "$added_at"}, "last_added": {"$max": "$added_at"}}},
+        {"$group": {"_id": "$_id.user", "entries": {"$sum": "$count"},
+                    "medications": {"$push": {"k": "$_id.drug", "v": {"name": "$name", "count": "$count",
+                                                                    "first_added": "$first_added",
+                                                                    "last_added": "$last_added"}}}}},
+        {"$set": {"medications": {"$arrayToObject": "$medications"}, "healthRecords": 0, "updated_at": "$$NOW"}},
+        mergeInto("replace")
+    ]
+    systems = [
+        {"$match": match},
+        *joinDrugs(),
+        {"$unwind": "$summary.systems"},
+        {"$group": {"_id": {"user": "$user_id", "system": "$summary.systems", "month": "$month"}, "count": {"$sum": 1}}},
+        {"$group": {"_id": {"user": "$_id.user", "system": "$_id.system"},
+                    "months": {"$push": {"k": "$_id.month", "v": "$count"}}}},
+        {"$group": {"_id": "$_id.user", "systems": {"$push": {"k": "$_id.system", "v": {"$arrayToObject": "$months"}}}}},
+        {"$set": {"systems": {"$arrayToObject": "$systems"}}},
+        mergeInto("merge")
+    ]
+    negative = [
+        {"$match": match},
+        *joinDrugs(),
+        {"$set": {"negative": {"$objectToArray": {"$ifNull": ["$summary.negative", {}]}}}},
+        {"$unwind": "$negative"},
+        {"$group": {"_id": {"user": "$user_id", "region": "$negative.k"}, "count": {"$sum": "$negative.v"}}},
+        {"$group": {"_id": "$_id.user", "negativeByRegion": {"$push": {"k": "$_id.region", "v": "$count"}}}},
+        {"$set": {"negativeByRegion": {"$arrayToObject": "$negativeByRegion"}}},
+        mergeInto("merge")
+    ]
+    records = [
+        {"$match": match},
+        {"$group": {"_id": "$user_id", "healthRecords": {"$sum": 1}}},
+        mergeInto("merge")
+    ]
+    return [("medication_history", medications), ("medication_history", systems),
+            ("medication_history", negative), ("health_records", records)]
+
+
+# Fn: recompute()
+# Brief: Rebuilds rollups server side with $merge, for one user or everyone. Use after a backfill,
+#        a migration, or when drugs referenced by old entries have since been generated.
+def recompute(userId=None):
+    db = Database().db
+    match = {} if userId is None else {"user_id": userId}
+    backfillSummaries()
+    backfillDrugNames(match)
+    if userId is not None:
+        db[ROLLUPS].delete_one({"_id": userId})
+    for collection, pipeline in rollupPipelines(match):
+        db[collection].aggregate(pipeline)
+
+
+# Fn: getDashboard()
+# Brief: Reads a user's rollup and shapes it for display
+# Rets: dict - active medications (most recent first), systems over time, NEGATIVE effects per region and totals
+def getDashboard(userId, activeDays=ACTIVE_DAYS):
+    rollup = Database().db[ROLLUPS].find_one({"_id": userId}) or {}
+    cutoff = datetime.now() - timedelta(days=activeDays)
+    medications = [dict(info, drug=drug) for drug, info in (rollup.get("medications") or {}).items()]
+    active = sorted((med for med in medications if med.get("last_added") and med["last_added"] >= cutoff),
+                    key=lambda med: med["last_added"], reverse=True)
+    return {
+        "activeMedications": active,
+        "medicationCount": len(medications),
+        "entries": rollup.get("entries", 0),
+        "healthRecords": rollup.get("healthRecords", 0),
+        "systems": rollup.get("systems") or {},
+        "negativeByRegion": rollup.get("negativeByRegion") or {},
+        "updatedAt": rollup.get("updated_at")
+    }
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Rebuild Health Dashboard rollups from the history collections")
+    argParser.add_argument("--user", help="Only rebuild this user id")
+    args = argParser.parse_args()
+
+    recompute(ObjectId(args.user) if args.user else None)
+    print("Rollups rebuilt")
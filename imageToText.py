@@ -1,10 +1,20 @@
 import PIL.Image
 from PIL import ImageFile
-from client import getFormatting, imagePrompt
+from client import getFormatting, imagePrompt, imagePromptStream, stripJsonTag
+from image_preprocess import getPreprocessor
+from streaming_json import IncrementalJsonParser
+import image_dedup
+import model_routing
 
 class ImageToText:
-    def __init__(self, format: str, context: str = None, customPrompt = None):
+    # Fields reported by processStream() as soon as they're complete, None for every top level field
+    streamFields = None
+    task = model_routing.DEFAULT # Which route the extraction prompt takes, see model_routing
+
+    def __init__(self, format: str, context: str = None, customPrompt = None, preprocessor = None, dedupScope = None):
         self.format = getFormatting(format)
+        self.preprocessor = preprocessor or getPreprocessor()
+        self.lastPreprocess = None
         if customPrompt:
             self.prompt = customPrompt
         elif context:
@@ -12,13 +22,65 @@ class ImageToText:
         else:
             self.prompt = f"Please extract the text from this image into the following json format: {self.format}"
 
-    def process(self, image: ImageFile):
+        # Near-duplicate scans (same label photographed again) reuse the earlier extraction. Opt in per
+        # user with dedupScope, results are never shared between scopes
+        self.dedupIndex = image_dedup.getIndex(self.prompt, dedupScope)
+
+    # Fn: process()
+    # Brief: Extracts the image's text. sourceBytes is the upload size for images decoded from memory
+    def process(self, image: ImageFile, sourceBytes = None):
         # image = PIL.Image.open(imagePath)
-        response = imagePrompt(self.prompt, image)
+        prepared = self.preprocessor.process(image, sourceBytes)
+        self.lastPreprocess = prepared
+
+        hashValue = None
+        if self.dedupIndex:
+            hashValue = self.dedupIndex.hash(prepared.image)
+            response = self.dedupIndex.lookup(prepared.image, hashValue)
+            if response is not None:
+                return response
+
+        response = imagePrompt(self.prompt, prepared.data, prepared.mimeType, self.task)
+        if self.dedupIndex:
+            self.dedupIndex.add(prepared.image, response, hashValue)
         return response
 
+    # Fn: processTextStream()
+    # Brief: Like process(), but yields the raw response text in chunks as it streams in
+    def processTextStream(self, image: ImageFile, sourceBytes = None):
+        prepared = self.preprocessor.process(image, sourceBytes)
+        self.lastPreprocess = prepared
+
+        hashValue = None
+        if self.dedupIndex:
+            hashValue = self.dedupIndex.hash(prepared.image)
+            response = self.dedupIndex.lookup(prepared.image, hashValue)
+            if response is not None:
+                yield response
+                return
+
+        chunks = []
+        for chunk in imagePromptStream(self.prompt, prepared.data, prepared.mimeType, self.task):
+            chunks.append(chunk)
+            yield chunk
+
+        if self.dedupIndex:
+            self.dedupIndex.add(prepared.image, stripJsonTag("".join(chunks).strip()), hashValue)
+
+    # Fn: processStream()
+    # Brief: Like process(), but parses the JSON response while it streams in
+    # Rets: generator - (path, value) for each field in streamFields as it completes, then ((), full result)
+    def processStream(self, image: ImageFile, sourceBytes = None):
+        parser = IncrementalJsonParser(self.streamFields)
+        for chunk in self.processTextStream(image, sourceBytes):
+            yield from parser.feed(chunk)
+
+        yield (), parser.result()
+
 class ImageToFacts(ImageToText):
-    def __init__(self):
+    task = model_routing.LABEL_EXTRACTION
+
+    def __init__(self, dedupScope = None):
 
         prmt = """
         Please extract the text from the image of a prescription into something similar to the following format
@@ -39,10 +101,19 @@ class ImageToFacts(ImageToText):
         Take with or without food. Avoid potassium supplements.
         """
 
-        super(ImageToFacts, self).__init__('label', customPrompt=prmt)
+        super(ImageToFacts, self).__init__('label', customPrompt=prmt, dedupScope=dedupScope)
 
 class ImageToDoctorsNote(ImageToText):
-    def __init__(self, prefferredLanguage):
+    streamFields = [
+        ("originalText",),
+        ("outputContent", "text"),
+        ("outputContent", "prescribed", "*"),
+        ("originalLanguage",),
+        ("outputLanguage",)
+    ]
+    task = model_routing.NOTE_TRANSLATION
+
+    def __init__(self, prefferredLanguage, dedupScope = None):
 
         context = f"""
         Here are your instructions for processing a doctors note.
@@ -52,7 +123,7 @@ class ImageToDoctorsNote(ImageToText):
         4. If no prescriptions are present, don't put any elements in the prescribed array.
         5. If prescriptions are present, add them to the array with the given template
         """
-        super(ImageToDoctorsNote, self).__init__('doctornote', context)
+        super(ImageToDoctorsNote, self).__init__('doctornote', context, dedupScope=dedupScope)
 
 if __name__ == "__main__":
     imgToFacts = ImageToFacts()
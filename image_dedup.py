@@ -0,0 +1,210 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Fn: dHash()
+# Brief: Difference hash, one bit per horizontally adjacent pixel pair of a 9x8 grayscale thumbnail
+# Rets: int - 64 bit hash
+def dHash(image, hashSize=8):
+    thumb = image.convert("L").resize((hashSize + 1, hashSize), Image.Resampling.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return bitsToInt(bits)
+
+
+def dctMatrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+DCT_32 = dctMatrix(32)
+
+
+# Fn: pHash()
+# Brief: Perceptual hash, low frequency DCT coefficients of a 32x32 thumbnail compared against their median.
+#        Holds up better than dHash against lighting changes and re-compression
+# Rets: int - 64 bit hash
+def pHash(image, hashSize=8):
+    thumb = image.convert("L").resize((32, 32), Image.Resampling.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.float64)
+    dct = DCT_32 @ pixels @ DCT_32.T
+    low = dct[:hashSize, :hashSize].flatten()
+    median = np.median(low[1:]) # Skip the DC term, it's just overall brightness
+    return bitsToInt(low > median)
+
+
+def bitsToInt(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+HASHERS = {"dhash": dHash, "phash": pHash}
+
+
+# Fn: fingerprint()
+# Brief: 64x64 grayscale thumbnail normalized to zero mean and unit variance, used to confirm a hash match
+# Rets: np.ndarray of float32
+def fingerprint(image, size=64):
+    thumb = image.convert("L").resize((size, size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.float32)
+    pixels = pixels - pixels.mean()
+    return pixels / (pixels.std() or 1.0)
+
+
+# Fn: similarity()
+# Brief: Pearson correlation of two fingerprints, 1.0 for the same picture, unaffected by brightness and contrast
+def similarity(a, b):
+    return float((a * b).mean())
+
+
+# Metric tree over Hamming distance, lets a lookup skip most stored hashes via the triangle inequality
+class BKTree:
+    def __init__(self):
+        self.root = None # [hash, value, {distance: child}]
+        self.count = 0
+
+    def add(self, hashValue, value):
+        self.count += 1
+        if self.root is None:
+            self.root = [hashValue, value, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming(hashValue, node[0])
+            if distance == 0:
+                node[1] = value # Same hash, keep the newest result
+                self.count -= 1
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hashValue, value, {}]
+                return
+            node = child
+
+    # Fn: search()
+    # Brief: Finds every stored hash within maxDistance
+    # Rets: list - (distance, hash, value) sorted closest first
+    def search(self, hashValue, maxDistance):
+        if self.root is None:
+            return []
+
+        matches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(hashValue, node[0])
+            if distance <= maxDistance:
+                matches.append((distance, node[0], node[1]))
+            for childDistance, child in node[2].items():
+                if distance - maxDistance <= childDistance <= distance + maxDistance:
+                    stack.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+# Remembers extraction results by perceptual hash so a re-photographed scan reuses the earlier result.
+# A 64 bit hash alone can't tell two labels with the same pharmacy layout apart, so every hash match is
+# confirmed against a higher resolution fingerprint before its result is reused.
+class ScanDedupIndex:
+    def __init__(self, threshold=5, maxEntries=5000, kind="dhash", minSimilarity=0.97):
+        self.threshold = threshold # Max differing bits (out of 64) to still count as a candidate
+        self.minSimilarity = minSimilarity # Fingerprint correlation a candidate needs to be reused
+        self.maxEntries = maxEntries
+        self.hasher = HASHERS[kind]
+        self.tree = BKTree()
+        self.order = deque() # Insertion order, oldest entries are dropped first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hash(self, image):
+        return self.hasher(image)
+
+    # Fn: lookup()
+    # Brief: Finds the result of the closest previously seen scan within the threshold whose fingerprint
+    #        also matches
+    # Rets: The stored result or None
+    def lookup(self, image, hashValue=None):
+        hashValue = self.hash(image) if hashValue is None else hashValue
+        with self.lock:
+            matches = self.tree.search(hashValue, self.threshold)
+        if matches:
+            probe = fingerprint(image)
+            for _, _, (stored, value) in matches:
+                if similarity(probe, stored) >= self.minSimilarity:
+                    with self.lock:
+                        self.hits += 1
+                    return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def add(self, image, value, hashValue=None):
+        hashValue = self.hash(image) if hashValue is None else hashValue
+        entry = (fingerprint(image), value)
+        with self.lock:
+            self.tree.add(hashValue, entry)
+            self.order.append((hashValue, entry))
+            if len(self.order) > self.maxEntries:
+                self.rebuild()
+
+    # BK-trees can't delete, so eviction drops the oldest tenth and rebuilds from the rest
+    def rebuild(self):
+        for _ in range(max(len(self.order) // 10, 1)):
+            self.order.popleft()
+
+        # Only the newest value per hash is live in the tree
+        latest = dict(self.order)
+        self.order = deque((hashValue, value) for hashValue, value in self.order if latest[hashValue] is value)
+        self.tree = BKTree()
+        for hashValue, value in self.order:
+            self.tree.add(hashValue, value)
+
+
+indexes = OrderedDict() # Least recently used scope first
+indexesLock = threading.Lock()
+
+
+# Fn: getIndex()
+# Brief: One index per prompt and scope (a user id), a result is only reusable for the same extraction
+#        instructions and never by anyone else. Once the indexes together hold more than
+#        SCAN_DEDUP_TOTAL_ENTRIES fingerprints, the least recently used scopes are dropped
+# Rets: ScanDedupIndex or None when deduplication is disabled or no scope was given
+def getIndex(prompt, scope):
+    threshold = int(os.getenv("SCAN_DEDUP_THRESHOLD", "5"))
+    if threshold < 0 or scope is None:
+        return None
+
+    key = (hashlib.sha256(prompt.encode("utf-8")).hexdigest(), str(scope))
+    with indexesLock:
+        if key not in indexes:
+            indexes[key] = ScanDedupIndex(
+                threshold=threshold,
+                maxEntries=int(os.getenv("SCAN_DEDUP_MAX_ENTRIES", "5000")),
+                kind=os.getenv("SCAN_DEDUP_HASH", "dhash"),
+                minSimilarity=float(os.getenv("SCAN_DEDUP_MIN_SIMILARITY", "0.97"))
+            )
+        indexes.move_to_end(key)
+
+        budget = int(os.getenv("SCAN_DEDUP_TOTAL_ENTRIES", "10000"))
+        total = sum(len(index.order) for index in indexes.values())
+        while total > budget and len(indexes) > 1:
+            _, evicted = indexes.popitem(last=False)
+            total -= len(evicted.order)
+        return indexes[key]
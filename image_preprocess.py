@@ -0,0 +1,178 @@
+import io
+import os
+import time
+from PIL import Image, ImageChops, ImageOps
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+
+class PreprocessResult:
+    def __init__(self, data, mimeType, image, originalBytes, timings):
+        self.data = data
+        self.image = image # The processed image the bytes were encoded from
+        self.mimeType = mimeType
+        self.size = image.size
+        self.originalBytes = originalBytes
+        self.timings = timings # step name -> seconds
+
+    @property
+    def bytes(self):
+        return len(self.data)
+
+    @property
+    def savedBytes(self):
+        if self.originalBytes is None:
+            return None
+        return self.originalBytes - self.bytes
+
+    def summary(self):
+        saved = self.savedBytes
+        steps = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.timings.items())
+        savedText = f"saved {saved} bytes" if saved is not None else "original size unknown"
+        return f"{self.size[0]}x{self.size[1]} {self.bytes} bytes ({savedText}) [{steps}]"
+
+
+# Fn: parseCrop()
+# Brief: Reads IMAGE_CROP, either "auto" or a "left,top,right,bottom" box in pixels
+# Rets: None, "auto" or a tuple of 4 ints
+def parseCrop(value):
+    value = (value or "").strip().lower()
+    if not value:
+        return None
+    if value == "auto":
+        return "auto"
+    try:
+        box = tuple(int(part) for part in value.split(","))
+    except ValueError:
+        box = ()
+    if len(box) != 4:
+        raise ValueError(f"IMAGE_CROP must be \"auto\" or \"left,top,right,bottom\", got {value!r}")
+    return box
+
+
+# Shrinks scans before they're uploaded to the vision model. The model reads labels fine at ~1600px,
+# phone cameras produce 4000px+ images several MB in size.
+class ImagePreprocessor:
+    def __init__(self, maxEdge=1600, grayscale=False, crop=None, byteBudget=400 * 1024,
+                 quality=85, minQuality=40):
+        self.maxEdge = maxEdge
+        self.grayscale = grayscale
+        self.crop = crop # None, "auto" (crop to the label) or a (left, top, right, bottom) box
+        self.byteBudget = byteBudget
+        self.quality = quality
+        self.minQuality = minQuality
+
+    @classmethod
+    def fromEnv(cls):
+        return cls(
+            maxEdge=int(os.getenv("IMAGE_MAX_EDGE", "1600")),
+            grayscale=os.getenv("IMAGE_GRAYSCALE", "0").lower() in ("1", "true", "yes"),
+            crop=parseCrop(os.getenv("IMAGE_CROP")),
+            byteBudget=int(os.getenv("IMAGE_BYTE_BUDGET", str(400 * 1024)))
+        )
+
+    # Fn: process()
+    # Brief: Runs every step on the image and re-encodes it as JPEG
+    # Args: sourceBytes - Size of the upload the image was decoded from, when it wasn't opened from a file
+    # Rets: PreprocessResult - The encoded bytes plus size savings and per step timings
+    def process(self, image, sourceBytes=None):
+        with metrics.span("image.preprocess") as span:
+            result = self.preprocess(image, sourceBytes)
+            span.set(bytes=result.bytes, originalBytes=result.originalBytes)
+        return result
+
+    def preprocess(self, image, sourceBytes=None):
+        timings = {}
+        originalBytes = sourceBytes if sourceBytes is not None else self.originalSize(image)
+
+        start = time.perf_counter()
+        image = ImageOps.exif_transpose(image)
+        timings["orient"] = time.perf_counter() - start
+
+        if self.crop:
+            start = time.perf_counter()
+            image = self.cropImage(image)
+            timings["crop"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image = self.downscale(image, self.maxEdge)
+        timings["resize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image = image.convert("L") if self.grayscale else image.convert("RGB")
+        timings["convert"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data, image = self.encode(image)
+        timings["encode"] = time.perf_counter() - start
+
+        return PreprocessResult(data, "image/jpeg", image, originalBytes, timings)
+
+    # Fn: originalSize()
+    # Brief: Size of the file the image was loaded from, which is what would've been uploaded otherwise
+    def originalSize(self, image):
+        filename = getattr(image, "filename", None)
+        if filename and os.path.exists(filename):
+            return os.path.getsize(filename)
+        return None
+
+    def downscale(self, image, maxEdge):
+        if max(image.size) <= maxEdge:
+            return image
+        image = image.copy()
+        image.thumbnail((maxEdge, maxEdge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        return image
+
+    # Fn: cropImage()
+    # Brief: Crops to the given box, or for "auto" to whatever differs from the background colour in the corners
+    def cropImage(self, image):
+        if self.crop != "auto":
+            return image.crop(tuple(self.crop))
+
+        gray = image.convert("L")
+        width, height = gray.size
+        corners = [gray.getpixel((0, 0)), gray.getpixel((width - 1, 0)),
+                   gray.getpixel((0, height - 1)), gray.getpixel((width - 1, height - 1))]
+        background = sorted(corners)[len(corners) // 2]
+
+        diff = ImageChops.difference(gray, Image.new("L", gray.size, background))
+        mask = diff.point(lambda value: 255 if value > 40 else 0)
+        box = mask.getbbox()
+        if not box:
+            return image
+
+        # Keep a small margin so text on the label's edge isn't clipped
+        padX, padY = width // 50, height // 50
+        box = (max(box[0] - padX, 0), max(box[1] - padY, 0),
+               min(box[2] + padX, width), min(box[3] + padY, height))
+        return image.crop(box)
+
+    # Fn: encode()
+    # Brief: Encodes as JPEG, lowering quality and then resolution until the byte budget is met
+    # Rets: tuple - (bytes, image that was encoded)
+    def encode(self, image):
+        while True:
+            quality = self.quality
+            while True:
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=quality, optimize=True)
+                data = buffer.getvalue()
+                if not self.byteBudget or len(data) <= self.byteBudget or quality <= self.minQuality:
+                    break
+                quality = max(quality - 10, self.minQuality)
+
+            if not self.byteBudget or len(data) <= self.byteBudget or max(image.size) <= 512:
+                return data, image
+            image = self.downscale(image, int(max(image.size) * 0.75))
+
+
+defaultPreprocessor = None
+
+
+def getPreprocessor():
+    global defaultPreprocessor
+    if defaultPreprocessor is None:
+        defaultPreprocessor = ImagePreprocessor.fromEnv()
+    return defaultPreprocessor
@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# Lanes, lower runs first. Interactive is anything a user is waiting on (scanner, visualizer, Qt app),
+# background is bulk work (prefetch_drugs). Background may only spend tokens while the bucket holds
+# more than the interactive reserve, so a bulk job can never drain the budget users need. The bucket
+# itself checks the reserve, so it holds across replicas sharing a MongoTokenBucket too.
+INTERACTIVE = 0
+BACKGROUND = 1
+LANE_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+RATE_PER_MINUTE = float(os.getenv("GEMINI_RATE_PER_MINUTE", "0")) # 0 disables the limiter
+BURST = float(os.getenv("GEMINI_BURST", "0")) or None # Defaults to one second of rate, and always holds 1 + the reserve
+BACKEND = os.getenv("GEMINI_RATE_BACKEND", "local").strip().lower() # local or mongo (shared by every replica)
+BACKGROUND_RESERVE = float(os.getenv("GEMINI_BACKGROUND_RESERVE", "0.25")) # Fraction of the burst kept for interactive, at least 1 token
+
+currentLane = contextvars.ContextVar("llmLane", default=INTERACTIVE)
+QUEUE_WAIT = metrics.histogram("llm_queue_wait_seconds", "Time model requests waited for the rate limiter and a concurrency slot")
+RETRIES = metrics.counter("llm_retries_total", "Model requests retried, by status code")
+
+
+# Fn: lane()
+# Brief: Runs the model calls made inside the block in the given lane, e.g. `with lane(BACKGROUND):`
+@contextmanager
+def lane(priority):
+    token = currentLane.set(priority)
+    try:
+        yield
+    finally:
+        currentLane.reset(token)
+
+
+# Fn: inLane()
+# Brief: Wraps a coroutine so it runs in a lane, for handing work to another thread's event loop
+#        (context variables don't follow run_coroutine_threadsafe)
+async def inLane(coro, priority):
+    token = currentLane.set(priority)
+    try:
+        return await coro
+    finally:
+        currentLane.reset(token)
+
+
+def observeWait(priority, seconds):
+    if metrics.enabled:
+        QUEUE_WAIT.observe(seconds, lane=LANE_NAMES.get(priority, str(priority)))
+
+
+# Token bucket for this process. take() never blocks, the limiter decides how to wait.
+class TokenBucket:
+    blocking = False # take() is cheap enough to call on the event loop
+
+    def __init__(self, ratePerSecond, burst):
+        self.rate = ratePerSecond
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Fn: take()
+    # Brief: Takes one token if at least `minimum` are available
+    # Rets: float - 0 if a token was taken, else seconds until there should be enough
+    def take(self, minimum=1.0):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= minimum:
+                self.tokens -= 1
+                return 0.0
+            return (minimum - self.tokens) / self.rate
+
+
+# Token bucket kept in MongoDB so every replica draws from one budget. The refill and take happen
+# in a single pipeline update, so concurrent takers can't both spend the last token.
+class MongoTokenBucket:
+    blocking = True # A round trip, run it off the event loop
+
+    def __init__(self, ratePerSecond, burst, name="gemini", collectionName="RateLimits"):
+        self.rate = ratePerSecond
+        self.burst = burst
+        self.name = name
+        self.collectionName = collectionName
+        self.collection = None
+
+    def getCollection(self):
+        if self.collection is None:
+            from database.db_connection import Database
+            self.collection = Database().get_collection(self.collectionName)
+        return self.collection
+
+    def take(self, minimum=1.0):
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [self.burst, {"$add": [{"$ifNull": ["$tokens", self.burst]}, {"$multiply": [elapsed, self.rate]}]}]}
+        doc = self.getCollection().find_one_and_update(
+            {"_id": self.name},
+            [
+                {"$set": {"tokens": refilled, "updated": "$$NOW"}},
+                {"$set": {"granted": {"$gte": ["$tokens", minimum]}}},
+                {"$set": {"tokens": {"$cond": ["$granted", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc["granted"]:
+            return 0.0
+        return (minimum - doc["tokens"]) / self.rate
+
+
+# Hands out bucket tokens strictly by lane, then arrival order. One per event loop; the bucket
+# behind it is shared by the whole process (or every replica for MongoTokenBucket).
+class PriorityLimiter:
+    def __init__(self, bucket, reserve):
+        self.bucket = bucket
+        self.reserve = reserve # Tokens background requests must leave in the bucket
+        self.waiters = [] # heap of (lane, arrival)
+        self.arrivals = itertools.count()
+        self.changed = asyncio.Event()
+
+    async def take(self, minimum):
+        if self.bucket.blocking:
+            return await asyncio.to_thread(self.bucket.take, minimum)
+        return self.bucket.take(minimum)
+
+    # Fn: acquire()
+    # Brief: Waits for a token in the given lane
+    async def acquire(self, priority):
+        entry = (priority, next(self.arrivals))
+        heapq.heappush(self.waiters, entry)
+        try:
+            while True:
+                if self.waiters[0] == entry:
+                    minimum = 1.0 if priority == INTERACTIVE else 1.0 + self.reserve
+                    delay = await self.take(minimum)
+                    if delay == 0:
+                        return
+                else:
+                    delay = 1.0 # Not our turn, wait for the queue to move (re-checking now and then)
+
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+            self.changed.set() # Let the next in line (or a newly arrived interactive request) try
+
+
+limiters = weakref.WeakKeyDictionary() # event loop -> PriorityLimiter
+bucket = None
+reserve = 0.0
+bucketLock = threading.Lock()
+
+
+# Fn: sizeBucket()
+# Brief: Works out the burst and interactive reserve for a rate. The reserve is at least one token and
+#        the burst always has room for it plus the token a background request takes, so at low rates
+#        (free tier quotas, 60 RPM and below) background work still leaves a request for users
+# Rets: tuple - (burst, reserve) in tokens
+def sizeBucket(ratePerSecond, burst=None, reserveFraction=BACKGROUND_RESERVE):
+    burst = burst or max(1.0, ratePerSecond)
+    reserve = max(1.0, reserveFraction * burst) if reserveFraction > 0 else 0.0
+    return max(burst, 1.0 + reserve), reserve
+
+
+def getBucket():
+    global bucket, reserve
+    with bucketLock:
+        if bucket is None and RATE_PER_MINUTE > 0:
+            rate = RATE_PER_MINUTE / 60
+            burst, reserve = sizeBucket(rate, BURST)
+            bucket = MongoTokenBucket(rate, burst) if BACKEND == "mongo" else TokenBucket(rate, burst)
+        return bucket
+
+
+# Fn: configure()
+# Brief: Overrides the env settings for this process, e.g. from a CLI flag. Takes effect for requests
+#        made afterwards; a rate of 0 disables the limiter
+def configure(ratePerMinute=None, burst=None, backend=None):
+    global RATE_PER_MINUTE, BURST, BACKEND, bucket
+    with bucketLock:
+        if ratePerMinute is not None:
+            RATE_PER_MINUTE = float(ratePerMinute)
+        if burst is not None:
+            BURST = float(burst) or None
+        if backend is not None:
+            BACKEND = backend.strip().lower()
+        bucket = None
+        limiters.clear()
+
+
+# Fn: getLimiter()
+# Brief: The limiter for the running event loop, or None when GEMINI_RATE_PER_MINUTE isn't set
+def getLimiter():
+    if getBucket() is None:
+        return None
+    loop = asyncio.get_running_loop()
+    if loop not in limiters:
+        limiters[loop] = PriorityLimiter(getBucket(), reserve)
+    return limiters[loop]
+
+
+# Fn: acquire()
+# Brief: Waits for a rate limiter token in the current lane (a no-op when unlimited)
+async def acquire():
+    limiter = getLimiter()
+    if limiter is not None:
+        await limiter.acquire(currentLane.get())
+
+
+# Fn: isRetryable()
+# Brief: True for rate limiting (429) and server side (5xx) errors from the Gemini API
+def isRetryable(error):
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    retryable = code == 429 or (isinstance(code, int) and 500 <= code < 600)
+    if retryable and metrics.enabled:
+        RETRIES.inc(status=str(code))
+    return retryable
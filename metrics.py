@@ -0,0 +1,337 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pymongo import monitoring
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Off unless METRICS_ENABLED=1. Disabled spans return a shared no-op object, so instrumented code
+# pays for one flag check and nothing else.
+enabled = os.getenv("METRICS_ENABLED", "0") == "1"
+logSpans = os.getenv("METRICS_LOG", "0") == "1"
+PREFIX = "healthlens_"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger("healthlens.metrics")
+registry = dict() # metric name -> Counter or Histogram
+registryLock = threading.Lock()
+server = None
+serverLock = threading.Lock()
+
+
+def labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def formatLabels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = dict() # label key -> float
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = labelKey(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(labelKey(labels), 0)
+
+    def render(self):
+        with self.lock:
+            return [f"{self.name}{formatLabels(key)} {value}" for key, value in self.values.items()]
+
+    def snapshot(self):
+        with self.lock:
+            return [{"labels": dict(key), "value": value} for key, value in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = dict() # label key -> [bucket counts..., +Inf count], sum
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = labelKey(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total) in self.series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{formatLabels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{formatLabels(key)} {total}")
+                lines.append(f"{self.name}_count{formatLabels(key)} {cumulative}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return [{"labels": dict(key), "count": sum(counts), "sum": total,
+                     "buckets": dict(zip([str(bound) for bound in self.buckets + ("+Inf",)], counts))}
+                    for key, (counts, total) in self.series.items()]
+
+
+def getMetric(cls, name, help, **kwargs):
+    name = PREFIX + name
+    metric = registry.get(name)
+    if metric is None:
+        with registryLock:
+            metric = registry.get(name)
+            if metric is None:
+                metric = registry[name] = cls(name, help, **kwargs)
+    return metric
+
+
+def counter(name, help=""):
+    return getMetric(Counter, name, help)
+
+
+def histogram(name, help="", buckets=LATENCY_BUCKETS):
+    return getMetric(Histogram, name, help, buckets=buckets)
+
+
+STAGE_SECONDS = histogram("stage_seconds", "Time spent in each instrumented stage")
+STAGE_ERRORS = counter("stage_errors_total", "Stages that raised")
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups by cache and result (hit or miss)")
+LLM_TOKENS = counter("llm_tokens_total", "Model tokens by direction (prompt or response)")
+LLM_UPLOAD_BYTES = counter("llm_upload_bytes_total", "Image bytes sent to the model")
+MONGO_SECONDS = histogram("mongo_command_seconds", "MongoDB command round trips by command name")
+MONGO_FAILURES = counter("mongo_command_failures_total", "MongoDB commands that failed")
+
+
+class NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+# Times one stage into STAGE_SECONDS. Extra fields given to set() only go to the JSON log line.
+class Span:
+    __slots__ = ("stage", "labels", "fields", "start")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.fields = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, stage=self.stage, **self.labels)
+        if excType is not None and issubclass(excType, Exception): # Not GeneratorExit from a closed stream
+            STAGE_ERRORS.inc(stage=self.stage, error=excType.__name__)
+        if logSpans:
+            record = {"ts": time.time(), "stage": self.stage, "seconds": round(elapsed, 6),
+                      "ok": excType is None, **self.labels, **(self.fields or {})}
+            logger.info(json.dumps(record, default=str))
+        return False
+
+    def set(self, **fields):
+        if self.fields is None:
+            self.fields = {}
+        self.fields.update(fields)
+
+
+# Fn: span()
+# Brief: Context manager timing a stage, e.g. `with metrics.span("llm.generate"):`
+def span(stage, **labels):
+    if not enabled:
+        return NOOP_SPAN
+    return Span(stage, labels)
+
+
+# Fn: timed()
+# Brief: Decorator version of span() for a whole function
+def timed(stage):
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with Span(stage, {}):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorator
+
+
+def countCache(cache, hit):
+    if enabled:
+        CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# Fn: countUsage()
+# Brief: Records the token counts from a generate_content response's usage_metadata
+def countUsage(response):
+    if not enabled:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_token_count", None) or 0, direction="prompt")
+    LLM_TOKENS.inc(getattr(usage, "candidates_token_count", None) or 0, direction="response")
+
+
+def countUpload(size):
+    if enabled:
+        LLM_UPLOAD_BYTES.inc(size)
+
+
+# Times every MongoDB command the client sends, registered on the shared MongoClient
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_FAILURES.inc(command=event.command_name)
+
+
+# Fn: mongoListeners()
+# Brief: Event listeners for MongoClient(event_listeners=...), none when metrics are off
+def mongoListeners():
+    return [MongoCommandListener()] if enabled else []
+
+
+# Fn: configureLogging()
+# Brief: Sends span records to stderr as one JSON object per line, unless the app configured the logger itself
+def configureLogging():
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# Fn: setEnabled()
+# Brief: Turns instrumentation on or off at runtime. Mongo timing only follows for clients created afterwards.
+def setEnabled(value, log=None):
+    global enabled, logSpans
+    enabled = bool(value)
+    if log is not None:
+        logSpans = bool(log)
+    if logSpans:
+        configureLogging()
+
+
+def reset():
+    for metric in list(registry.values()):
+        with metric.lock:
+            if isinstance(metric, Counter):
+                metric.values.clear()
+            else:
+                metric.series.clear()
+
+
+# Fn: renderPrometheus()
+# Brief: All metrics in the Prometheus text exposition format
+def renderPrometheus():
+    lines = []
+    for name, metric in sorted(registry.items()):
+        series = metric.render()
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        lines.extend(series)
+    return "\n".join(lines) + "\n"
+
+
+# Fn: snapshot()
+# Brief: All metrics as a JSON friendly dict, plus the cache hit ratio per cache
+def snapshot():
+    data = {name: metric.snapshot() for name, metric in sorted(registry.items())}
+    ratios = dict()
+    for entry in CACHE_REQUESTS.snapshot():
+        cache = entry["labels"]["cache"]
+        hits, total = ratios.get(cache, (0, 0))
+        ratios[cache] = (hits + (entry["value"] if entry["labels"]["result"] == "hit" else 0), total + entry["value"])
+    data["cache_hit_ratio"] = {cache: hits / total for cache, (hits, total) in ratios.items() if total}
+    return data
+
+
+if logSpans:
+    configureLogging()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, contentType = json.dumps(snapshot(), default=str).encode(), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, contentType = renderPrometheus().encode(), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood stderr
+
+
+# Fn: startServer()
+# Brief: Serves /metrics (Prometheus text) and /metrics.json from a daemon thread, once per process.
+#        Does nothing when metrics are off or no port is configured (METRICS_PORT).
+def startServer(port=None):
+    global server
+    port = port if port is not None else int(os.getenv("METRICS_PORT", "0"))
+    if not enabled or not port:
+        return None
+    with serverLock:
+        if server is None:
+            server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "127.0.0.1"), port), MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import llm_limiter
+import metrics
+
+load_dotenv()
+
+# Tasks, each routed to its own model with its own timeout and latency budget
+DEFAULT = "default"
+DRUG_EFFECTS = "drug_effects"
+DRUG_EFFECTS_BATCH = "drug_effects_batch" # Several drugs per prompt (findAffectedMany), much slower than one
+LABEL_EXTRACTION = "label_extraction"
+NOTE_TRANSLATION = "note_translation"
+TERM_SIMPLIFICATION = "term_simplification"
+
+HEDGING = os.getenv("GEMINI_HEDGING", "1") == "1"
+HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20")) # Before this many, hedge after the route's hedgeAfter
+LATENCY_WINDOW = 200
+
+HEDGES = metrics.counter("llm_hedges_total", "Hedged second requests by task and which request won")
+FALLBACKS = metrics.counter("llm_fallbacks_total", "Requests sent to a task's fallback model, by task and reason")
+
+
+# Where one task's requests go. timeout bounds the primary model (hedge included), budget bounds
+# the whole request including the fallback, both counted from when the primary request is first sent.
+class Route:
+    def __init__(self, task, model, fallback=None, timeout=30.0, budget=None, hedgeAfter=None):
+        prefix = "GEMINI_" + task.upper()
+        self.task = task
+        self.model = os.getenv(prefix + "_MODEL", model)
+        self.fallback = os.getenv(prefix + "_FALLBACK", fallback) or None
+        self.timeout = float(os.getenv(prefix + "_TIMEOUT", timeout))
+        self.budget = float(os.getenv(prefix + "_BUDGET", budget or self.timeout * 1.5))
+        self.hedgeAfter = float(os.getenv(prefix + "_HEDGE_AFTER", hedgeAfter or self.timeout / 3))
+        self.latency = LatencyTracker()
+
+    # Fn: hedgeDelay()
+    # Brief: How long the first request gets before a second one is sent, the observed p95 once known
+    def hedgeDelay(self):
+        p95 = self.latency.percentile(0.95)
+        return self.hedgeAfter if p95 is None else p95
+
+
+# Recent successful latencies for one route, shared by every event loop in the process
+class LatencyTracker:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    # Rets: float or None when there are fewer than HEDGE_MIN_SAMPLES samples
+    def percentile(self, fraction):
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+routes = {route.task: route for route in (
+    Route(DEFAULT, "gemini-2.0-flash", timeout=60),
+    # Long JSON per drug, slow but nobody is staring at a spinner for the whole of it
+    Route(DRUG_EFFECTS, "gemini-2.0-flash", "gemini-2.0-flash-lite", timeout=60, budget=90),
+    Route(DRUG_EFFECTS_BATCH, "gemini-2.0-flash", "gemini-2.0-flash-lite", timeout=120, budget=180),
+    # The scanner waits on these
+    Route(LABEL_EXTRACTION, "gemini-2.0-flash", "gemini-2.0-flash-lite", timeout=20, budget=30),
+    Route(NOTE_TRANSLATION, "gemini-2.0-flash", "gemini-2.0-flash-lite", timeout=30, budget=45),
+    Route(TERM_SIMPLIFICATION, "gemini-2.0-flash-lite", "gemini-2.0-flash", timeout=15, budget=20)
+)}
+
+
+# One request's handle. The attempt wraps just the model call in timing(), so queueing for the rate
+# limiter and retry backoff neither count towards the task's latency nor start the hedge timer or timeout.
+class Call:
+    def __init__(self, tracker=None):
+        self.sent = asyncio.Event()
+        self.sentAt = None # time.monotonic() of the first send, retries don't move it
+        self.tracker = tracker
+
+    @contextmanager
+    def timing(self):
+        if self.sentAt is None:
+            self.sentAt = time.monotonic()
+        self.sent.set()
+        start = time.perf_counter()
+        yield
+        if self.tracker is not None:
+            self.tracker.observe(time.perf_counter() - start)
+
+
+def getRoute(task):
+    route = routes.get(task or DEFAULT)
+    if route is None:
+        raise ValueError(f"Unknown model task {task}, expected one of {', '.join(routes)}")
+    return route
+
+
+# Fn: route()
+# Brief: Runs attempt(model) on the task's model, hedging it once it runs past the task's p95, and
+#        on the fallback model if that fails or times out. Hedging is skipped in the background lane
+#        so bulk jobs don't double their quota use. The timeout and budget count from when the primary
+#        request is first sent, waiting on the rate limiter is the limiter's business
+# Args: attempt - async fn(model, call) making one request, with the model call inside call.timing()
+#       discard - async fn(result) releasing a result that lost the race, e.g. an open stream
+# Rets: attempt's result from whichever request finished first
+async def route(task, attempt, discard=None):
+    taskRoute = getRoute(task)
+    hedge = HEDGING and llm_limiter.currentLane.get() == llm_limiter.INTERACTIVE
+    primary = Call(taskRoute.latency)
+    try:
+        return await race(taskRoute, taskRoute.model, attempt, discard,
+                          min(taskRoute.timeout, taskRoute.budget), hedge, primary)
+    except Exception as error:
+        elapsed = 0 if primary.sentAt is None else time.monotonic() - primary.sentAt
+        remaining = taskRoute.budget - elapsed
+        if taskRoute.fallback is None or taskRoute.fallback == taskRoute.model or remaining <= 0:
+            raise
+        if metrics.enabled:
+            FALLBACKS.inc(task=taskRoute.task, reason=type(error).__name__)
+        # The fallback's latency says nothing about the primary model's, so it isn't tracked
+        return await race(taskRoute, taskRoute.fallback, attempt, discard,
+                          min(taskRoute.timeout, remaining), False, Call())
+
+
+# Fn: race()
+# Brief: One model's part of route(), raises TimeoutError once timeout passes. Both the timeout and the
+#        hedge timer start once the first request is actually sent, a request still queued is never
+#        timed out or hedged
+async def race(route, model, attempt, discard, timeout, hedge, firstCall):
+    def start(call):
+        return asyncio.ensure_future(attempt(model, call))
+
+    first = start(firstCall)
+    requests = [first]
+    winner = None
+    error = None
+    try:
+        sent = asyncio.ensure_future(firstCall.sent.wait())
+        try:
+            await asyncio.wait({first, sent}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sent.cancel()
+        deadline = (firstCall.sentAt or time.monotonic()) + timeout
+
+        if hedge and not first.done():
+            remaining = deadline - time.monotonic()
+            done, _ = await asyncio.wait(requests, timeout=max(0, min(route.hedgeDelay(), remaining)))
+            if not done and time.monotonic() < deadline:
+                requests.append(start(Call(firstCall.tracker)))
+
+        pending = set(requests)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for request in done:
+                if request.exception() is None:
+                    winner = winner or request
+                else:
+                    error = request.exception()
+
+        if winner is None:
+            if error is not None and not pending:
+                raise error
+            raise asyncio.TimeoutError(f"{route.task} got no response from {model} within {timeout:g}s")
+        if len(requests) > 1 and metrics.enabled:
+            HEDGES.inc(task=route.task, winner="hedge" if winner is requests[1] else "first")
+        return winner.result()
+    finally:
+        losers = [request for request in requests if request is not winner]
+        for request in losers:
+            request.cancel()
+        for result in await asyncio.gather(*losers, return_exceptions=True):
+            if discard is not None and not isinstance(result, BaseException):
+                await discard(result) # Finished just as it lost
@@ -0,0 +1,122 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from database.schema import ensure_schema
+from drug_affection import MAX_BATCH, findAffectedMany, queryMany
+from drug_names import normalizeDrugName
+import llm_limiter
+
+
+# Fn: readFormulary()
+# Brief: Reads one drug name per line, skipping blanks and # comments
+# Rets: list - (original name, normalized name) pairs, first spelling of each drug wins
+def readFormulary(path):
+    names = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            normalized = normalizeDrugName(line)
+            if normalized and normalized not in seen:
+                seen.add(normalized)
+                names.append((line, normalized))
+    return names
+
+
+# Fn: readProgress()
+# Brief: Loads the names finished by a previous (possibly interrupted) run
+def readProgress(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+# Fn: findExisting()
+# Brief: Finds which of the names are already answered by Drugs, directly or through an alias
+def findExisting(normalizedNames, chunkSize=1000):
+    existing = set()
+    for i in range(0, len(normalizedNames), chunkSize):
+        existing.update(queryMany(normalizedNames[i:i + chunkSize]))
+    return existing
+
+
+# Fn: generateChunk()
+# Brief: Generates and stores a chunk of drugs through findAffectedMany, MAX_BATCH drugs per prompt.
+#        The requests are paced by the shared llm_limiter budget
+# Args: chunk - list of (original name, normalized name)
+# Rets: list - normalized names that are now stored
+def generateChunk(chunk):
+    with llm_limiter.lane(llm_limiter.BACKGROUND): # Interactive requests go first when the shared budget is tight
+        drugs = findAffectedMany([name for name, _ in chunk])
+    return [normalized for name, normalized in chunk if drugs.get(name)]
+
+
+def main(argv=None):
+    argParser = argparse.ArgumentParser(description="Pre-generate drug effects for a formulary so interactive lookups hit the Drugs cache")
+    argParser.add_argument("formulary", help="Text file with one drug name per line")
+    argParser.add_argument("--concurrency", type=int, default=4, help="Chunks generated at once")
+    argParser.add_argument("--rate", type=float, help="Model requests per minute for this process's limiter, "
+                           "overriding GEMINI_RATE_PER_MINUTE (0 for unlimited)")
+    argParser.add_argument("--batch-size", type=int, default=20, help=f"Drugs per chunk, prompted {MAX_BATCH} at a time and stored with one bulk_write")
+    argParser.add_argument("--progress-file", help="Where finished names are recorded for resuming (default: <formulary>.progress)")
+    args = argParser.parse_args(argv)
+
+    progressPath = args.progress_file or f"{args.formulary}.progress"
+    ensure_schema()
+    if args.rate is not None:
+        llm_limiter.configure(ratePerMinute=args.rate)
+
+    names = readFormulary(args.formulary)
+    done = readProgress(progressPath)
+    pending = [(name, normalized) for name, normalized in names if normalized not in done]
+    existing = findExisting([normalized for _, normalized in pending])
+    todo = [(name, normalized) for name, normalized in pending if normalized not in existing]
+
+    print(f"{len(names)} drugs in formulary, {len(names) - len(pending)} done in earlier runs, "
+          f"{len(existing)} already stored, {len(todo)} to generate")
+    if not todo:
+        return 0
+
+    chunks = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+    finished = 0
+    failed = []
+    start = time.monotonic()
+
+    with open(progressPath, "a", encoding="utf-8") as progress, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for normalized in existing:
+            progress.write(f"{normalized}\n")
+
+        futures = {pool.submit(generateChunk, chunk): chunk for chunk in chunks}
+        try:
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    stored = future.result()
+                except Exception as e:
+                    stored = []
+                    print(f"\nFailed to generate {', '.join(name for name, _ in chunk)}: {e}", file=sys.stderr)
+                failed.extend(name for name, normalized in chunk if normalized not in stored)
+
+                finished += len(chunk)
+                progress.writelines(f"{normalized}\n" for normalized in stored)
+                progress.flush()
+
+                elapsed = time.monotonic() - start
+                rate = finished / elapsed if elapsed else 0
+                eta = (len(todo) - finished) / rate if rate else 0
+                print(f"\r[{finished}/{len(todo)}] failed={len(failed)} {rate * 60:.1f}/min eta={eta:.0f}s", end="", flush=True)
+        except KeyboardInterrupt:
+            print("\nInterrupted, chunks in flight will finish. Rerun the same command to resume.")
+            for future in futures:
+                future.cancel()
+
+    print(f"\nGenerated {finished - len(failed)} drugs, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
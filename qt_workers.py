@@ -0,0 +1,91 @@
+import inspect
+import traceback
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+# Signals live on a QObject created in the GUI thread, so emitting them from a pool thread
+# queues the slot call back onto the GUI thread
+class WorkerSignals(QObject):
+    progress = pyqtSignal(object)
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()
+
+
+# Runs fn(*args, **kwargs) on a QThreadPool thread. If fn takes a `worker` argument it gets this
+# Worker, so it can call worker.report(...) for progress and check worker.isCancelled().
+class Worker(QRunnable):
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+        try:
+            if "worker" in inspect.signature(fn).parameters:
+                self.kwargs["worker"] = self
+        except (TypeError, ValueError):
+            pass
+
+    def cancel(self):
+        """Request cancellation. A blocking call already in flight can't be interrupted, but its result is dropped"""
+        self.cancelled = True
+
+    def isCancelled(self):
+        return self.cancelled
+
+    def report(self, value):
+        if not self.cancelled:
+            self.signals.progress.emit(value)
+
+    def run(self):
+        try:
+            if self.cancelled:
+                self.signals.cancelled.emit()
+                return
+
+            result = self.fn(*self.args, **self.kwargs)
+            if self.cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.result.emit(result)
+        except Exception as e:
+            traceback.print_exc()
+            if self.cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+
+# Per widget helper: submits workers, keeps them referenced until they finish and
+# cancels the previous request when a newer one replaces it
+class BackgroundTasks:
+    def __init__(self, pool=None):
+        self.pool = pool or QThreadPool.globalInstance()
+        self.active = set()
+
+    def submit(self, fn, *args, on_result=None, on_error=None, on_progress=None,
+               on_cancelled=None, on_finished=None, replace=True, **kwargs):
+        if replace:
+            self.cancel_all()
+
+        worker = Worker(fn, *args, **kwargs)
+        for signal, slot in ((worker.signals.result, on_result), (worker.signals.error, on_error),
+                             (worker.signals.progress, on_progress), (worker.signals.cancelled, on_cancelled),
+                             (worker.signals.finished, on_finished)):
+            if slot:
+                signal.connect(slot)
+        worker.signals.finished.connect(lambda: self.active.discard(worker))
+
+        self.active.add(worker)
+        self.pool.start(worker)
+        return worker
+
+    def cancel_all(self):
+        for worker in list(self.active):
+            worker.cancel()
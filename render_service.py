@@ -0,0 +1,121 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from response_cache import LRUTier, MISS
+import metrics
+
+THEMES = {
+    "light": {"background": "#FFFFFF", "label": "#424242"},
+    "dark": {"background": "#0E1117", "label": "#FAFAFA"}
+}
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+# Fn: renderBodyMap()
+# Brief: Draws one body map with the Agg backend and returns the encoded image. Runs inside a pool process.
+# Rets: bytes - PNG or SVG data
+def renderBodyMap(affections, theme="light", fmt="png", size=(4, 6), dpi=100):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from body_map import BodyMapRenderer
+
+    colors = THEMES[theme]
+    fig = Figure(figsize=size, dpi=dpi, facecolor=colors["background"])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    renderer = BodyMapRenderer(ax, animated=False, labelColor=colors["label"])
+    renderer.applyHighlight(affections)
+
+    out = io.BytesIO()
+    fig.savefig(out, format=fmt, facecolor=colors["background"], bbox_inches="tight")
+    return out.getvalue()
+
+
+# Renders body maps in worker processes (matplotlib isn't thread-safe, and Streamlit runs each
+# session in its own thread) and keeps the bytes, so reruns and popular drugs never redraw.
+class RenderService:
+    def __init__(self, workers=2, cacheEntries=512, cacheBytes=64 * 1024 * 1024):
+        self.workers = workers
+        self.cache = LRUTier(cacheEntries, cacheBytes)
+        self.pool = None
+        self.pending = dict() # cache key -> Future, so concurrent requests share one render
+        self.lock = threading.Lock()
+
+    def getPool(self):
+        with self.lock:
+            if self.pool is None:
+                # spawn, forking a process that has threads (Streamlit, pymongo) can deadlock the child
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            return self.pool
+
+    @staticmethod
+    def cacheKey(drug, theme, fmt):
+        drugId = drug.get("_id") or drug.get("name")
+        return f"{drugId}:{drug.get('version', 1)}:{theme}:{fmt}"
+
+    # Fn: render()
+    # Brief: Gets the body map for a drug document, rendering it only on a cache miss
+    # Rets: bytes - PNG or SVG data
+    def render(self, drug, theme="light", fmt="png"):
+        if theme not in THEMES:
+            raise ValueError(f"Unknown theme {theme}, expected one of {list(THEMES)}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt}, expected one of {list(FORMATS)}")
+
+        key = self.cacheKey(drug, theme, fmt)
+        data = self.cache.get(key)
+        metrics.countCache("render", data is not MISS)
+        if data is not MISS:
+            return data
+
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.pending[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            with metrics.span("render.body_map", format=fmt):
+                data = self.getPool().submit(renderBodyMap, drug.get("affections", {}), theme, fmt).result()
+            self.cache.set(key, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+
+service = None
+serviceLock = threading.Lock()
+
+
+# Fn: getRenderService()
+# Brief: The process wide render service, sized from RENDER_WORKERS, RENDER_CACHE_ENTRIES and RENDER_CACHE_BYTES
+def getRenderService():
+    global service
+    with serviceLock:
+        if service is None:
+            service = RenderService(
+                workers=int(os.getenv("RENDER_WORKERS", "2")),
+                cacheEntries=int(os.getenv("RENDER_CACHE_ENTRIES", "512")),
+                cacheBytes=int(os.getenv("RENDER_CACHE_BYTES", str(64 * 1024 * 1024)))
+            )
+        return service
@@ -0,0 +1,385 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Sentinel so a cached empty string still counts as a hit
+MISS = object()
+
+
+# Fn: imageDigest()
+# Brief: Hashes the image payload so identical uploads share a cache key
+# Rets: str - sha256 hex digest, or "" when there is no image
+def imageDigest(image):
+    if image is None:
+        return ""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(image).hexdigest()
+
+    # PIL images: hash the decoded pixels along with mode/size so re-encodes of the same photo still match
+    h = hashlib.sha256()
+    h.update(f"{image.mode}:{image.size}".encode("utf-8"))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+# Fn: makeKey()
+# Brief: Builds the cache key from everything that changes the model output
+def makeKey(model, header, text, image=None):
+    h = hashlib.sha256()
+    for part in (model, header or "", text, imageDigest(image)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+
+    def hitRatio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def to_dict(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "sets": self.sets,
+            "evictions": self.evictions,
+            "hit_ratio": self.hitRatio()
+        }
+
+
+# In-process tier, bounded by entry count and total bytes. Entries expire ttlSeconds after they were written
+class LRUTier:
+    name = "memory"
+
+    def __init__(self, maxEntries=1024, maxBytes=32 * 1024 * 1024, ttlSeconds=7 * 24 * 3600):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttlSeconds = ttlSeconds
+        self.entries = OrderedDict() # key -> (value, written at)
+        self.size = 0
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttlSeconds and time.time() - entry[1] > self.ttlSeconds:
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return MISS
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        valueSize = len(value)
+        if valueSize > self.maxBytes:
+            return
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (value, time.time())
+            self.size += valueSize
+            self.stats.sets += 1
+
+            while len(self.entries) > self.maxEntries or self.size > self.maxBytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats.evictions += 1
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# On-disk tier, one file per key. A file's mtime is when it was written (what the TTL counts from) and its
+# atime when it was last read, eviction drops the least recently read files past the byte limit.
+# The total size is tracked as files are written and removed, the directory is only walked at startup
+# and when an eviction is due (which also picks up files other processes wrote).
+class DiskTier:
+    name = "disk"
+
+    def __init__(self, directory, maxBytes=256 * 1024 * 1024, ttlSeconds=7 * 24 * 3600):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.ttlSeconds = ttlSeconds
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+        self.total = None # Bytes on disk, counted on first write
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if self.ttlSeconds and time.time() - mtime > self.ttlSeconds:
+                self._remove(path)
+                self.stats.misses += 1
+                return MISS
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+            os.utime(path, (time.time(), mtime))  # Mark it read for eviction, leaving the write time alone
+        except OSError:
+            self.stats.misses += 1
+            return MISS
+
+        self.stats.hits += 1
+        return value
+
+    def set(self, key, value):
+        if len(value.encode("utf-8")) > self.maxBytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename so concurrent readers never see a partial file
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmpPath, "w", encoding="utf-8") as f:
+            f.write(value)
+        size = os.path.getsize(tmpPath)
+        try:
+            previous = os.path.getsize(path)
+        except OSError:
+            previous = 0
+        os.replace(tmpPath, path)
+        self.stats.sets += 1
+
+        with self.lock:
+            if self.total is None:
+                self.total = self._scan()[1]
+            else:
+                self.total += size - previous
+            overBudget = self.total > self.maxBytes
+        if overBudget:
+            self.evict()
+
+    def _remove(self, path):
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self.lock:
+            if self.total is not None:
+                self.total -= size
+
+    def delete(self, key):
+        try:
+            self._remove(self._path(key))
+        except OSError:
+            pass
+
+    # Fn: _scan()
+    # Rets: ([(atime, size, path)], total bytes) for every cache file
+    def _scan(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+        return files, total
+
+    def evict(self):
+        with self.lock:
+            files, total = self._scan()
+            self.total = total
+            if total <= self.maxBytes:
+                return
+            files.sort()
+            target = self.maxBytes * 0.9 # Leave room so the next few writes don't trigger another walk
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.stats.evictions += 1
+            self.total = total
+
+    def clear(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+        with self.lock:
+            self.total = None
+
+
+# Shared tier so every app replica benefits from each other's responses. Mongo expires entries with a TTL index
+class MongoTier:
+    name = "mongo"
+
+    def __init__(self, collectionName="ResponseCache", ttlSeconds=7 * 24 * 3600, maxValueBytes=1024 * 1024):
+        self.collectionName = collectionName
+        self.ttlSeconds = ttlSeconds
+        self.maxValueBytes = maxValueBytes
+        self.stats = CacheStats()
+        self.collection = None
+        self.lock = threading.Lock()
+
+    def getCollection(self):
+        with self.lock:
+            if self.collection is None:
+                from database.db_connection import Database
+
+                self.collection = Database().get_collection(self.collectionName)
+        return self.collection
+
+    def get(self, key):
+        doc = self.getCollection().find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"value": 1}
+        )
+        if not doc:
+            self.stats.misses += 1
+            return MISS
+        self.stats.hits += 1
+        return doc["value"]
+
+    def set(self, key, value):
+        if len(value.encode("utf-8")) > self.maxValueBytes:
+            return
+        now = datetime.now(timezone.utc)  # TTL monitor compares against UTC
+        self.getCollection().update_one(
+            {"_id": key},
+            {"$set": {
+                "value": value,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=self.ttlSeconds)
+            }},
+            upsert=True
+        )
+        self.stats.sets += 1
+
+    def delete(self, key):
+        self.getCollection().delete_one({"_id": key})
+
+    def clear(self):
+        self.getCollection().delete_many({})
+
+
+class ResponseCache:
+    def __init__(self, tiers):
+        self.tiers = tiers
+
+    # Fn: get()
+    # Brief: Looks the key up tier by tier, back-filling the faster tiers on a hit
+    # Rets: The cached value or MISS
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            try:
+                value = tier.get(key)
+            except Exception as e:
+                print(f"Response cache {tier.name} tier failed: {e}")
+                continue
+            if value is not MISS:
+                for faster in self.tiers[:i]:
+                    self._safeSet(faster, key, value)
+                return value
+        return MISS
+
+    def set(self, key, value):
+        for tier in self.tiers:
+            self._safeSet(tier, key, value)
+
+    # Fn: delete()
+    # Brief: Drops the key from every tier, for responses the caller couldn't use
+    def delete(self, key):
+        for tier in self.tiers:
+            try:
+                tier.delete(key)
+            except Exception as e:
+                print(f"Response cache {tier.name} tier failed: {e}")
+
+    def _safeSet(self, tier, key, value):
+        try:
+            tier.set(key, value)
+        except Exception as e:
+            print(f"Response cache {tier.name} tier failed: {e}")
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self):
+        return {tier.name: tier.stats.to_dict() for tier in self.tiers}
+
+
+def _envFlag(name, default="0"):
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+# Fn: buildFromEnv()
+# Brief: Builds the cache tiers from the RESPONSE_CACHE_* environment variables
+def buildFromEnv():
+    if not _envFlag("RESPONSE_CACHE_ENABLED", "1"):
+        return ResponseCache([])
+
+    tiers = [LRUTier(
+        maxEntries=int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024")),
+        maxBytes=int(os.getenv("RESPONSE_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024))),
+        ttlSeconds=int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+    )]
+
+    diskDir = os.getenv("RESPONSE_CACHE_DIR", ".cache/responses")
+    if diskDir:
+        tiers.append(DiskTier(
+            diskDir,
+            maxBytes=int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(256 * 1024 * 1024))),
+            ttlSeconds=int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+        ))
+
+    if _envFlag("RESPONSE_CACHE_MONGO"):
+        tiers.append(MongoTier(ttlSeconds=int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))))
+
+    return ResponseCache(tiers)
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+def getCache():
+    global _cache
+    if _cache is None:
+        with _cacheLock:
+            if _cache is None:
+                _cache = buildFromEnv()
+    return _cache
+
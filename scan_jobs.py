@@ -0,0 +1,244 @@
+import argparse
+import io
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import PIL.Image
+from bson import Binary, ObjectId
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+from database.db_connection import Database
+from database.schema import ensure_schema
+from imageToText import ImageToDoctorsNote, ImageToFacts
+from scan_pipeline import parseMedicationNames
+import metrics
+
+load_dotenv()
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# Mongo documents are capped at 16 MB, the image shares its job document with the result
+MAX_IMAGE_BYTES = int(os.getenv("SCAN_MAX_IMAGE_BYTES", str(8 * 1024 * 1024)))
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+# Scan jobs persisted in Mongo so any worker (thread, process or another machine) can pick them up
+class ScanJobQueue:
+    def __init__(self, collectionName="ScanJobs", leaseSeconds=120, maxAttempts=3):
+        self.collection = Database().get_collection(collectionName)
+        self.leaseSeconds = leaseSeconds # A running job whose worker died is retried after this long
+        self.maxAttempts = maxAttempts
+
+    # Fn: submit()
+    # Brief: Queues a scan of the image bytes. kind is "facts" (prescription label) or "doctorsNote"
+    # Rets: str - The job id to poll with get(), raises ValueError for images over MAX_IMAGE_BYTES
+    def submit(self, imageBytes, kind="facts", language=None, userId=None):
+        if len(imageBytes) > MAX_IMAGE_BYTES:
+            raise ValueError(f"Image is {len(imageBytes)} bytes, scans are limited to {MAX_IMAGE_BYTES}")
+        now = utcnow()
+        res = self.collection.insert_one({
+            "status": QUEUED,
+            "kind": kind,
+            "language": language,
+            "user_id": userId,
+            "image": Binary(imageBytes),
+            "attempts": 0,
+            "created_at": now,
+            "run_after": now,
+            "result": None,
+            "medications": [],
+            "error": None
+        })
+        return str(res.inserted_id)
+
+    # Fn: get()
+    # Brief: Fetches a job's status and result, without the image
+    def get(self, jobId):
+        return self.collection.find_one({"_id": ObjectId(jobId)}, {"image": 0})
+
+    # Fn: claim()
+    # Brief: Atomically takes the oldest runnable job, including ones whose previous worker's lease ran out
+    # Rets: The job document (with image) or None if there's nothing to do
+    def claim(self, workerId):
+        self.reapExpired()
+        now = utcnow()
+        return self.collection.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "run_after": {"$lte": now}},
+                {"status": RUNNING, "lease_until": {"$lt": now}, "attempts": {"$lt": self.maxAttempts}}
+            ]},
+            {
+                "$set": {"status": RUNNING, "worker": workerId, "started_at": now,
+                         "lease_until": now + timedelta(seconds=self.leaseSeconds)},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    # Fn: reapExpired()
+    # Brief: Fails running jobs whose lease ran out on their last attempt. claim() won't retry them, and
+    #        without this they'd stay running forever (the UI polling, the TTL never firing, the image kept)
+    def reapExpired(self):
+        now = utcnow()
+        self.collection.update_many(
+            {"status": RUNNING, "lease_until": {"$lt": now}, "attempts": {"$gte": self.maxAttempts}},
+            {"$set": {"status": FAILED, "error": "Worker stopped responding on the last attempt", "finished_at": now},
+             "$unset": {"image": "", "lease_until": ""}}
+        )
+
+    # Fn: owned()
+    # Brief: Filter matching the job only while this attempt still holds it. Once the lease expires and
+    #        another worker reclaims the job, attempts and worker change and a stale update matches nothing
+    def owned(self, job):
+        return {"_id": job["_id"], "status": RUNNING, "worker": job["worker"], "attempts": job["attempts"]}
+
+    # Fn: renewLease()
+    # Rets: bool - False if the job was taken over by another attempt
+    def renewLease(self, job):
+        res = self.collection.update_one(
+            self.owned(job),
+            {"$set": {"lease_until": utcnow() + timedelta(seconds=self.leaseSeconds)}}
+        )
+        return res.matched_count == 1
+
+    # Fn: keepLease()
+    # Brief: Renews the job's lease every third of leaseSeconds until the block exits
+    @contextmanager
+    def keepLease(self, job):
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.leaseSeconds / 3):
+                if not self.renewLease(job):
+                    return
+
+        thread = threading.Thread(target=renew, name=f"scan-lease-{job['_id']}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    # Rets: bool - False if the result was dropped because another attempt owns the job now
+    def complete(self, job, result, medications):
+        res = self.collection.update_one(
+            self.owned(job),
+            {"$set": {"status": DONE, "result": result, "medications": medications,
+                      "error": None, "finished_at": utcnow()},
+             "$unset": {"image": "", "lease_until": ""}}
+        )
+        return res.matched_count == 1
+
+    # Fn: fail()
+    # Brief: Requeues the job with exponential backoff, or marks it failed once it's out of attempts
+    # Rets: bool - False if another attempt owns the job now
+    def fail(self, job, error):
+        now = utcnow()
+        if job["attempts"] >= self.maxAttempts:
+            update = {"$set": {"status": FAILED, "error": error, "finished_at": now},
+                      "$unset": {"image": "", "lease_until": ""}}
+        else:
+            update = {"$set": {"status": QUEUED, "error": error,
+                               "run_after": now + timedelta(seconds=2 ** job["attempts"])},
+                      "$unset": {"lease_until": ""}}
+        return self.collection.update_one(self.owned(job), update).matched_count == 1
+
+
+# Fn: runJob()
+# Brief: Runs the extraction for one claimed job
+# Rets: tuple - (response text, medication names)
+def runJob(job):
+    image = PIL.Image.open(io.BytesIO(job["image"]))
+    scope = job.get("user_id") # Anonymous scans are never deduplicated
+    if job["kind"] == "doctorsNote":
+        extractor = ImageToDoctorsNote(job.get("language") or "english", dedupScope=scope)
+    else:
+        extractor = ImageToFacts(dedupScope=scope)
+
+    with metrics.span("scan.job", kind=job["kind"]):
+        result = extractor.process(image, sourceBytes=len(job["image"]))
+    return result, parseMedicationNames(result)
+
+
+# Fn: workerLoop()
+# Brief: Claims and runs jobs until stopEvent is set, sleeping pollInterval when the queue is empty.
+#        Queue errors (Mongo unreachable, a failed write) are logged and retried with backoff, the worker
+#        never exits on its own. A job whose result couldn't be recorded is retried once its lease expires
+def workerLoop(workerId, stopEvent, pollInterval=1.0, maxBackoff=30.0):
+    jobs = None
+    backoff = pollInterval
+    while not stopEvent.is_set():
+        try:
+            jobs = jobs or ScanJobQueue()
+            job = jobs.claim(workerId)
+            if not job:
+                stopEvent.wait(pollInterval)
+                continue
+
+            try:
+                with jobs.keepLease(job):
+                    result, medications = runJob(job)
+                jobs.complete(job, result, medications)
+            except Exception as e:
+                jobs.fail(job, f"{type(e).__name__}: {e}")
+            backoff = pollInterval
+        except Exception as e:
+            print(f"Scan worker {workerId} queue error, retrying in {backoff:g}s: {e}")
+            stopEvent.wait(backoff)
+            backoff = min(backoff * 2, maxBackoff)
+
+
+# A pool of scan workers. Threads suit the Streamlit process (the work is mostly waiting on the model),
+# processes suit a dedicated worker host.
+class ScanWorkerPool:
+    def __init__(self, workers=2, useProcesses=False, pollInterval=1.0):
+        self.workers = workers
+        self.useProcesses = useProcesses
+        self.pollInterval = pollInterval
+        self.stopEvent = multiprocessing.Event() if useProcesses else threading.Event()
+        self.handles = []
+
+    def start(self):
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.workers):
+            args = (f"{prefix}:{i}", self.stopEvent, self.pollInterval)
+            if self.useProcesses:
+                handle = multiprocessing.Process(target=workerLoop, args=args, name=f"scan-worker-{i}", daemon=True)
+            else:
+                handle = threading.Thread(target=workerLoop, args=args, name=f"scan-worker-{i}", daemon=True)
+            handle.start()
+            self.handles.append(handle)
+        return self
+
+    def stop(self, timeout=30):
+        self.stopEvent.set()
+        for handle in self.handles:
+            handle.join(timeout)
+        self.handles = []
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Run Prescription Scanner workers")
+    argParser.add_argument("--workers", type=int, default=int(os.getenv("SCAN_WORKERS", "2")))
+    argParser.add_argument("--processes", action="store_true", help="Run each worker in its own process")
+    args = argParser.parse_args()
+
+    ensure_schema()
+    metrics.startServer()
+    pool = ScanWorkerPool(args.workers, useProcesses=args.processes).start()
+    print(f"Started {args.workers} scan workers, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,186 @@
+import json
+import queue
+import re
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from drug_affection import DrugRegionParser, findAffectedMany
+from drug_names import normalizeDrugName
+from imageToText import ImageToFacts
+
+# "Medication: Lisinopril 10mg", "Medications: Aspirin 81mg, Plavix 75mg", "- Medication Name: Metformin"
+MEDICATION_LINE = re.compile(r"^\W*(?:medications?|drug|rx)(?:\s+name)?\s*:\s*(.+)$", re.IGNORECASE)
+
+
+# Fn: parseMedicationNames()
+# Brief: Pulls the medication names out of an ImageToFacts response (plain text) or a JSON label/doctor's note
+# Rets: list - Names in the order they appear, one spelling per drug
+def parseMedicationNames(text):
+    names = []
+    try:
+        data = json.loads(text)
+        prescribed = data.get("outputContent", {}).get("prescribed", []) if "outputContent" in data else [data]
+        names = [entry.get("name") for entry in prescribed if isinstance(entry, dict) and entry.get("name")]
+    except (ValueError, AttributeError):
+        scanner = MedicationLineScanner()
+        names = scanner.feed(text) + scanner.close()
+    return dedupeNames(names)
+
+
+def dedupeNames(names):
+    seen = set()
+    unique = []
+    for name in names:
+        normalized = normalizeDrugName(name)
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            unique.append(name)
+    return unique
+
+
+# Finds "Medication:" lines in text that arrives in chunks, reporting each one once its line is complete
+class MedicationLineScanner:
+    def __init__(self):
+        self.partial = ""
+
+    def feed(self, chunk):
+        self.partial += chunk
+        *lines, self.partial = self.partial.split("\n")
+        return self.parseLines(lines)
+
+    def close(self):
+        lines, self.partial = [self.partial], ""
+        return self.parseLines(lines)
+
+    def parseLines(self, lines):
+        names = []
+        for line in lines:
+            match = MEDICATION_LINE.match(line.strip())
+            if match:
+                names.extend(part.strip(" *") for part in match.group(1).split(",") if part.strip(" *"))
+        return names
+
+
+# Scan to body map in one call: preprocessing, streamed extraction, and effect lookups started as
+# medication lines arrive, while the model is still writing the rest of the label. Names arriving within
+# batchWindow of each other are looked up together, so a multi-drug label's misses share batched prompts.
+class ScanPipeline:
+    def __init__(self, extractor=None, maxLookups=4, batchWindow=0.5):
+        self.extractor = extractor or ImageToFacts()
+        self.maxLookups = maxLookups
+        self.batchWindow = batchWindow
+
+    # Fn: run()
+    # Brief: Runs the pipeline over one image
+    # Rets: generator - event dicts as each stage produces them:
+    #       {"stage": "text", "chunk"}, {"stage": "medication", "name"}, {"stage": "affected", "name", "drug"},
+    #       {"stage": "error", "name", "error"}, and finally {"stage": "done", "text", "medications", "seconds"}.
+    #       Closing the generator early stops the extraction and drops lookups that haven't started
+    def run(self, image):
+        events = queue.Queue()
+        waiting = queue.Queue() # Medications waiting for a lookup, None once extraction is over
+        start = time.perf_counter()
+        stop = threading.Event() # Set once the consumer stops listening
+        lookups = ThreadPoolExecutor(max_workers=self.maxLookups, thread_name_prefix="scan-lookup")
+        pending = []
+        seen = set()
+        medications = []
+        chunks = []
+
+        def lookup(batch):
+            try:
+                drugs = findAffectedMany(batch)
+            except Exception:
+                drugs = dict() # One failure sinks the whole call, retry each drug on its own
+            for name in batch:
+                try:
+                    drug = drugs.get(name) or DrugRegionParser(name).findAffected()
+                    events.put({"stage": "affected", "name": name, "drug": drug})
+                except Exception as e:
+                    events.put({"stage": "error", "name": name, "error": e})
+
+        # Groups names that arrive close together into one lookup
+        def dispatch():
+            finished = False
+            while not finished:
+                name = waiting.get()
+                if name is None:
+                    return
+                batch = [name]
+                deadline = time.monotonic() + self.batchWindow
+                while True:
+                    try:
+                        name = waiting.get(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if name is None:
+                        finished = True
+                        break
+                    batch.append(name)
+                if stop.is_set():
+                    return
+                try:
+                    pending.append(lookups.submit(lookup, batch))
+                except RuntimeError:
+                    return # Pool shut down, the consumer stopped between the check and the submit
+
+        def startLookups(names):
+            for name in names:
+                normalized = normalizeDrugName(name)
+                if not normalized or normalized in seen:
+                    continue
+                seen.add(normalized)
+                medications.append(name)
+                events.put({"stage": "medication", "name": name})
+                waiting.put(name)
+
+        dispatcher = threading.Thread(target=dispatch, name="scan-dispatch", daemon=True)
+        dispatcher.start()
+
+        def extract():
+            scanner = MedicationLineScanner()
+            stream = self.extractor.processTextStream(image)
+            try:
+                for chunk in stream:
+                    if stop.is_set():
+                        return
+                    chunks.append(chunk)
+                    events.put({"stage": "text", "chunk": chunk})
+                    startLookups(scanner.feed(chunk))
+                startLookups(scanner.close())
+
+                # The model may have answered in JSON rather than the plain label format
+                if not medications:
+                    startLookups(parseMedicationNames("".join(chunks)))
+            except Exception as e:
+                events.put({"stage": "error", "name": None, "error": e})
+            finally:
+                stream.close()
+                waiting.put(None)
+                dispatcher.join()
+                for future in list(pending):
+                    if future.cancelled():
+                        continue
+                    try:
+                        future.result()
+                    except CancelledError:
+                        pass
+                events.put(None)
+
+        threading.Thread(target=extract, name="scan-extract", daemon=True).start()
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            stop.set()
+            lookups.shutdown(wait=False, cancel_futures=True)
+
+        yield {
+            "stage": "done",
+            "text": "".join(chunks),
+            "medications": medications,
+            "seconds": time.perf_counter() - start
+        }
@@ -0,0 +1,127 @@
+import json
+
+WILDCARD = "*"
+
+
+# Parses a JSON document as it streams in and reports values as soon as they're complete.
+# Paths are tuples of keys/indexes, e.g. ("outputContent", "prescribed", 0). Patterns can use "*" for any key or index.
+# Anything before the first { or [ (like a ```json fence) and after the root closes is ignored.
+class IncrementalJsonParser:
+    def __init__(self, patterns=None):
+        self.patterns = [tuple(pattern) for pattern in patterns] if patterns is not None else None
+        self.buffer = ""
+        self.pos = 0
+        self.stack = [] # Open containers: dict(type, path, start, key, state, index)
+        self.started = False
+        self.rootStart = None
+        self.done = False
+        self.inString = False
+        self.escape = False
+        self.stringStart = None
+        self.stringIsKey = False
+        self.scalarStart = None
+
+    # Fn: feed()
+    # Brief: Adds the next chunk of text
+    # Rets: list - (path, value) for every matching value completed by this chunk
+    def feed(self, text):
+        self.buffer += text
+        events = []
+        buffer = self.buffer
+
+        while self.pos < len(buffer) and not self.done:
+            i = self.pos
+            c = buffer[i]
+            self.pos += 1
+
+            if not self.started:
+                if c in "{[":
+                    self.started = True
+                    self.rootStart = i
+                    self.push(c, (), i)
+                continue
+
+            if self.inString:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.inString = False
+                    if self.stringIsKey:
+                        frame = self.stack[-1]
+                        frame["key"] = json.loads(buffer[self.stringStart:i + 1])
+                        frame["state"] = "colon"
+                    else:
+                        self.emit(events, self.valuePath(), self.stringStart, i + 1)
+                continue
+
+            if self.scalarStart is not None:
+                if c not in ",}] \t\r\n":
+                    continue
+                self.emit(events, self.valuePath(), self.scalarStart, i)
+                self.scalarStart = None
+
+            if c in " \t\r\n":
+                continue
+
+            frame = self.stack[-1]
+            if c == '"':
+                self.inString = True
+                self.stringStart = i
+                self.stringIsKey = frame["type"] == "object" and frame["state"] == "key"
+            elif c in "{[":
+                self.push(c, self.valuePath(), i)
+            elif c in "}]":
+                self.stack.pop()
+                self.emit(events, frame["path"], frame["start"], i + 1)
+                if not self.stack:
+                    self.done = True
+            elif c == ":":
+                frame["state"] = "value"
+            elif c == ",":
+                if frame["type"] == "object":
+                    frame["state"] = "key"
+                else:
+                    frame["index"] += 1
+            else:
+                self.scalarStart = i # Number, true, false or null
+
+        return events
+
+    def push(self, c, path, start):
+        self.stack.append({
+            "type": "object" if c == "{" else "array",
+            "path": path,
+            "start": start,
+            "key": None,
+            "state": "key",
+            "index": 0
+        })
+
+    # Fn: valuePath()
+    # Brief: Path of the value that starts at the current position
+    def valuePath(self):
+        frame = self.stack[-1]
+        if frame["type"] == "object":
+            return frame["path"] + (frame["key"],)
+        return frame["path"] + (frame["index"],)
+
+    def emit(self, events, path, start, end):
+        if self.matches(path):
+            events.append((path, json.loads(self.buffer[start:end])))
+
+    def matches(self, path):
+        if self.patterns is None:
+            return len(path) == 1 # Default: each top level field
+        for pattern in self.patterns:
+            if len(pattern) == len(path) and all(p == WILDCARD or p == part for p, part in zip(pattern, path)):
+                return True
+        return False
+
+    # Fn: result()
+    # Brief: Parses the whole document once the stream has finished
+    def result(self):
+        if not self.done:
+            raise ValueError("JSON document is incomplete")
+        return json.loads(self.buffer[self.rootStart:self.pos])
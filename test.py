@@ -1,18 +1,21 @@
 import sys
 import json
 import os
-from imageToText import ImageToFacts
+from scan_pipeline import ScanPipeline
+from drug_affection import DrugRegionParser
+from database.schema import ensure_schema
+from qt_workers import BackgroundTasks
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel,
                              QPushButton, QVBoxLayout, QHBoxLayout, QTextEdit,
                              QFrame, QFileDialog, QComboBox, QStackedWidget,
                              QSplitter, QSizePolicy, QToolBar, QScrollArea,
                              QGraphicsDropShadowEffect)
 from PyQt6.QtGui import QPixmap, QImage, QFont, QIcon, QColor, QPalette, QFontDatabase
-from PyQt6.QtCore import Qt, QTimer, QSize, QPropertyAnimation, QEasingCurve, QRect
+from PyQt6.QtCore import Qt, QSize, QPropertyAnimation, QEasingCurve, QRect
 
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
-import matplotlib.patches as patches
+from body_map import BodyMapRenderer
 from PIL import Image, ImageQt
 
 # Style Constants
@@ -26,13 +29,30 @@ MATERIAL_TEXT_SECONDARY = "#757575"  # Medium gray text
 
 
 # Mock GeminiClient for demonstration purposes
+# Called from background workers (see qt_workers), never on the GUI thread
 class GeminiClient:
-    def analyze_prescription(self, image_path):
-        # Mock response that would come from Gemini API
-        imgToFact = ImageToFacts()
+    def analyze_prescription(self, image_path, worker=None):
+        # Streams the extraction so the text can be shown while the model is still writing it, and looks up
+        # each medication's effects as soon as its line arrives (see scan_pipeline)
         image = Image.open(image_path)
-        text = imgToFact.process(image)
-        return text
+        events = ScanPipeline().run(image)
+        chunks = []
+        drugs = {}
+        try:
+            for event in events:
+                if worker and worker.isCancelled():
+                    break
+                if event["stage"] == "text":
+                    chunks.append(event["chunk"])
+                    if worker:
+                        worker.report("".join(chunks))
+                elif event["stage"] == "affected":
+                    drugs[event["name"]] = event["drug"]
+                elif event["stage"] == "done":
+                    return {"text": event["text"], "medications": event["medications"], "drugs": drugs}
+        finally:
+            events.close() # Stops the extraction and pending lookups when cancelled
+        return {"text": "".join(chunks), "medications": [], "drugs": drugs}
         # return """
         # Medication: Lisinopril 10mg
         #
@@ -183,66 +203,12 @@ class MatplotlibCanvas(FigureCanvasQTAgg):
         super(MatplotlibCanvas, self).__init__(self.fig)
         self.setParent(parent)
 
-        # Using a better human body outline - stylized for material design
-        body = patches.Rectangle((0.3, 0.1), 0.4, 0.8, fill=False,
-                                 color='#424242', linewidth=3, linestyle='-')
-        self.ax.add_patch(body)
-
-        # Add better looking organs with subtle colors
-        # Brain
-        brain = patches.Circle((0.5, 0.9), 0.1, fill=True, alpha=0.5,
-                               color='#90CAF9', linewidth=0, edgecolor='none')
-        self.ax.add_patch(brain)
-        self.ax.text(0.5, 0.9, "Brain", ha='center', va='center',
-                     fontsize=10, fontweight='bold', color='#424242')
-
-        # Heart
-        heart = patches.Circle((0.5, 0.65), 0.08, fill=True, alpha=0.7,
-                               color='#EF5350', linewidth=0)
-        self.ax.add_patch(heart)
-        self.ax.text(0.5, 0.65, "Heart", ha='center', va='center',
-                     fontsize=10, fontweight='bold', color='#424242')
-
-        # Lungs
-        lungs_left = patches.Ellipse((0.4, 0.65), 0.1, 0.15, fill=True,
-                                     alpha=0.6, color='#FFCC80', linewidth=0)
-        lungs_right = patches.Ellipse((0.6, 0.65), 0.1, 0.15, fill=True,
-                                      alpha=0.6, color='#FFCC80', linewidth=0)
-        self.ax.add_patch(lungs_left)
-        self.ax.add_patch(lungs_right)
-        self.ax.text(0.4, 0.65, "Lung", ha='center', va='center',
-                     fontsize=9, fontweight='bold', color='#424242')
-        self.ax.text(0.6, 0.65, "Lung", ha='center', va='center',
-                     fontsize=9, fontweight='bold', color='#424242')
-
-        # Stomach
-        stomach = patches.Ellipse((0.5, 0.5), 0.15, 0.1, fill=True,
-                                  alpha=0.5, color='#81C784', linewidth=0)
-        self.ax.add_patch(stomach)
-        self.ax.text(0.5, 0.5, "Stomach", ha='center', va='center',
-                     fontsize=10, fontweight='bold', color='#424242')
-
-        # Liver
-        liver = patches.Ellipse((0.4, 0.45), 0.1, 0.08, fill=True,
-                                alpha=0.6, color='#A1887F', linewidth=0)
-        self.ax.add_patch(liver)
-        self.ax.text(0.4, 0.45, "Liver", ha='center', va='center',
-                     fontsize=9, fontweight='bold', color='#424242')
-
-        # Kidneys
-        kidney_left = patches.Ellipse((0.4, 0.4), 0.08, 0.05, fill=True,
-                                      alpha=0.7, color='#9575CD', linewidth=0)
-        kidney_right = patches.Ellipse((0.6, 0.4), 0.08, 0.05, fill=True,
-                                       alpha=0.7, color='#9575CD', linewidth=0)
-        self.ax.add_patch(kidney_left)
-        self.ax.add_patch(kidney_right)
-        self.ax.text(0.5, 0.4, "Kidneys", ha='center', va='center',
-                     fontsize=10, fontweight='bold', color='#424242')
-
-        # Remove axes
-        self.ax.set_xlim(0, 1)
-        self.ax.set_ylim(0, 1)
-        self.ax.axis('off')
+        # Organ shapes, colours and labels come from the body_map geometry table
+        self.body_map = BodyMapRenderer(self.ax)
+
+    def show_affections(self, affections):
+        # Only the region artists are recoloured and blitted, the figure isn't redrawn
+        self.body_map.highlight(affections)
 
 
 # Scanner Widget with Material Design
@@ -251,6 +217,7 @@ class ScannerWidget(QWidget):
         super().__init__(parent)
         self.parent = parent
         self.gemini_client = GeminiClient()
+        self.tasks = BackgroundTasks()
         self.current_image_path = None
         self.current_medication = None
         self.initUI()
@@ -393,19 +360,23 @@ class ScannerWidget(QWidget):
             self.results_text.setText("Please upload or take a prescription image first.")
             return
 
-        # For a hackathon, we can use a predefined response for demo purposes
         self.results_text.setText("Analyzing prescription...")
+        self.analyze_button.setEnabled(False)
+        self.view_effects_button.setEnabled(False)
 
-        # Simulate API call delay
-        QTimer.singleShot(1000, self.display_analysis_results)
-
-    def display_analysis_results(self):
-        # Get mock analysis result
-        analysis_result = self.gemini_client.analyze_prescription(self.current_image_path)
+        self.tasks.submit(
+            self.gemini_client.analyze_prescription, self.current_image_path,
+            on_progress=self.results_text.setText,
+            on_result=self.display_analysis_results,
+            on_error=lambda message: self.results_text.setText(f"Could not analyze prescription: {message}"),
+            on_finished=lambda: self.analyze_button.setEnabled(True)
+        )
 
-        self.results_text.setText(analysis_result)
-        self.current_medication = "Lisinopril"
-        self.view_effects_button.setEnabled(True)
+    def display_analysis_results(self, analysis_result):
+        self.results_text.setText(analysis_result["text"])
+        medications = analysis_result["medications"]
+        self.current_medication = medications[0] if medications else None
+        self.view_effects_button.setEnabled(self.current_medication is not None)
 
     def view_body_effects(self):
         # Switch to body viewer with current medication
@@ -420,12 +391,33 @@ class BodyViewerWidget(QWidget):
         super().__init__(parent)
         self.parent = parent
         self.medication_name = "Sample Medication"
+        self.tasks = BackgroundTasks()
         self.initUI()
 
     def set_medication(self, medication_name):
         self.medication_name = medication_name
         self.update_title()
-        self.update_info()
+        self.info_text.setText(f"Looking up how {medication_name} affects the body...")
+
+        # Only the latest medication matters, switching again cancels the previous lookup
+        self.tasks.submit(
+            lambda: DrugRegionParser(medication_name).findAffected(),
+            on_result=self.show_affections,
+            on_error=lambda message: self.info_text.setText(f"Could not load effects for {medication_name}: {message}")
+        )
+
+    def show_affections(self, drug):
+        lines = [f"{self.medication_name}:", ""]
+        for system, effects in drug["affections"].items():
+            if not effects:
+                continue
+            lines.append(f"{system.capitalize()}:")
+            for effect in effects:
+                sign = "+" if effect.get("responseType") == "POSITIVE" else "-"
+                lines.append(f"  {sign} {effect.get('name')}: {effect.get('responseDescription')}")
+            lines.append("")
+        self.info_text.setText("\n".join(lines))
+        self.canvas.show_affections(drug["affections"])
 
     def update_title(self):
         self.title_label.setText(f"How {self.medication_name} Affects Your Body")
@@ -528,6 +520,7 @@ class TranslatorWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.gemini_client = GeminiClient()
+        self.tasks = BackgroundTasks()
         self.initUI()
 
     def initUI(self):
@@ -666,19 +659,19 @@ class TranslatorWidget(QWidget):
 
         language = self.language_combo.currentText()
 
-        # For hackathon demo
         self.results_text.setText("Simplifying text...")
 
-        # Simulate API call delay
-        QTimer.singleShot(1000, self.display_simplified_text)
-
-    def display_simplified_text(self):
-        # Get mock simplification
-        simplified_text = self.gemini_client.simplify_medical_text("")
+        self.tasks.submit(
+            self.gemini_client.simplify_medical_text, medical_text,
+            on_result=self.display_simplified_text,
+            on_error=lambda message: self.results_text.setText(f"Could not simplify text: {message}")
+        )
 
+    def display_simplified_text(self, simplified_text):
         self.results_text.setText(simplified_text)
 
     def clear_all(self):
+        self.tasks.cancel_all()
         self.input_text.clear()
         self.results_text.clear()
 
@@ -700,6 +693,12 @@ class MedicalSimplifierApp(QMainWindow):
     def switch_to_tab(self, index):
         self.tab_widget.setCurrentIndex(index)
 
+    def closeEvent(self, event):
+        # Drop pending model calls instead of delivering results to closed widgets
+        for widget in (self.scanner_widget, self.body_viewer_widget, self.translator_widget):
+            widget.tasks.cancel_all()
+        super().closeEvent(event)
+
     def initUI(self):
         self.setWindowTitle("Medical Language Simplifier")
         self.setGeometry(100, 100, 1200, 800)
@@ -796,6 +795,7 @@ class MedicalSimplifierApp(QMainWindow):
 
 # Run the application
 if __name__ == "__main__":
+    ensure_schema()
     app = QApplication(sys.argv)
 
     # Enable high DPI scaling
@@ -0,0 +1,24 @@
+import pytest
+
+drug_affection = pytest.importorskip("drug_affection") # Needs pymongo and google-genai
+import llm_limiter
+
+
+def test_fallback_generations_keep_the_callers_lane(monkeypatch):
+    lanes = []
+
+    def generate(self):
+        lanes.append(llm_limiter.currentLane.get())
+        return {"name": self.normalizedName, "affections": {}}
+
+    monkeypatch.setattr(drug_affection, "queryMany", lambda names: {})
+    monkeypatch.setattr(drug_affection, "storeDrugs", lambda batch: None)
+    # An unparseable batch response sends every drug to the per-drug fallback
+    monkeypatch.setattr(drug_affection, "textPromptMany", lambda requests, *args, **kwargs: ["not json"] * len(requests))
+    monkeypatch.setattr(drug_affection.DrugRegionParser, "generate", generate)
+
+    with llm_limiter.lane(llm_limiter.BACKGROUND):
+        found = drug_affection.findAffectedMany(["Aspirin", "Ibuprofen", "Metformin"])
+
+    assert lanes == [llm_limiter.BACKGROUND] * 3
+    assert [drug["name"] for drug in found.values()] == ["aspirin", "ibuprofen", "metformin"]
@@ -0,0 +1,27 @@
+import pytest
+from drug_names import normalizeDrugName
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("ADVIL 200mg tablets ", "advil"),
+    ("Metformin HCl ER", "metformin"),
+    ("Losartan Potassium 50 mg", "losartan"),
+    ("Levothyroxine sodium", "levothyroxine"),
+    ("Aspirin 81 mg EC", "aspirin"),
+    ("Potassium chloride", "potassium chloride"),
+    ("Calcium carbonate", "calcium carbonate"),
+    ("Magnesium carbonate", "magnesium carbonate"),
+    ("Calcium gluconate", "calcium gluconate"),
+    ("Potassium gluconate", "potassium gluconate"),
+    ("Sodium bicarbonate", "sodium bicarbonate"),
+    ("Potassium bicarbonate", "potassium bicarbonate"),
+    ("Ferrous sulfate 325 mg", "ferrous sulfate"),
+])
+def test_normalize(name, expected):
+    assert normalizeDrugName(name) == expected
+
+
+def test_cation_salts_stay_distinct():
+    names = ["Calcium carbonate", "Magnesium carbonate", "Calcium gluconate", "Potassium gluconate",
+             "Sodium bicarbonate", "Potassium bicarbonate"]
+    assert len({normalizeDrugName(name) for name in names}) == len(names)
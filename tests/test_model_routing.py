@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+
+model_routing = pytest.importorskip("model_routing") # Needs pymongo for metrics
+
+
+@pytest.fixture
+def route(monkeypatch):
+    taskRoute = model_routing.Route("test", "primary", "fallback", timeout=0.3, budget=1.0, hedgeAfter=0.05)
+    monkeypatch.setitem(model_routing.routes, "test", taskRoute)
+    monkeypatch.setattr(model_routing, "HEDGING", True)
+    return taskRoute
+
+
+def test_queued_request_is_not_hedged_or_timed_out(route):
+    calls = []
+
+    async def attempt(model, call):
+        calls.append(model)
+        if len(calls) == 1:
+            await asyncio.sleep(0.5) # Waiting on the rate limiter, longer than the timeout
+        with call.timing():
+            await asyncio.sleep(0.01)
+        return model
+
+    assert asyncio.run(model_routing.route("test", attempt)) == "primary"
+    assert calls == ["primary"]
+
+
+def test_hedge_fires_once_the_first_request_is_sent(route):
+    calls = []
+
+    async def attempt(model, call):
+        calls.append(model)
+        with call.timing():
+            await asyncio.sleep(0.2 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    assert asyncio.run(model_routing.route("test", attempt)) == 2
+    assert calls == ["primary", "primary"]
+
+
+def test_losing_stream_is_discarded(route):
+    discarded = []
+    opened = []
+
+    async def attempt(model, call):
+        with call.timing():
+            opened.append(f"stream{len(opened) + 1}")
+            name = opened[-1]
+            # The hedge releases both, so both are open by the time the race picks a winner
+            if len(opened) == 2:
+                release.set()
+            await release.wait()
+        return name
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def raced():
+        nonlocal release
+        release = asyncio.Event()
+        return await model_routing.race(route, "primary", attempt, discard, 1.0, True, model_routing.Call())
+
+    release = None
+    route.hedgeAfter = 0
+    winner = asyncio.run(raced())
+    assert sorted([winner] + discarded) == ["stream1", "stream2"]
+
+
+def test_falls_back_when_the_primary_times_out(route, monkeypatch):
+    monkeypatch.setattr(model_routing, "HEDGING", False)
+    calls = []
+
+    async def attempt(model, call):
+        calls.append(model)
+        with call.timing():
+            await asyncio.sleep(5 if model == "primary" else 0.01)
+        return model
+
+    assert asyncio.run(model_routing.route("test", attempt)) == "fallback"
+    assert calls == ["primary", "fallback"]
@@ -0,0 +1,54 @@
+import json
+import pytest
+from streaming_json import IncrementalJsonParser
+
+DOCUMENT = '''```json
+{
+  "outputContent": {
+    "prescribed": [
+      {"name": "Lisinopril", "dose": 10, "notes": "Take with \\"water\\", once daily\\n"},
+      {"name": "Metformin \\u00e9", "dose": 500.5, "refills": null, "generic": true}
+    ],
+    "warnings": ["dizziness", "nausea, mild"]
+  },
+  "count": 2
+}
+```'''
+
+PATTERNS = [("outputContent", "prescribed", "*"), ("outputContent", "warnings", "*"), ("count",)]
+
+
+def parse(chunks, patterns=PATTERNS):
+    parser = IncrementalJsonParser(patterns)
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events, parser.result()
+
+
+def test_events_match_the_document():
+    events, result = parse([DOCUMENT])
+    expected = json.loads(DOCUMENT[len("```json"):-len("```")])
+    assert result == expected
+    assert events == [
+        (("outputContent", "prescribed", 0), expected["outputContent"]["prescribed"][0]),
+        (("outputContent", "prescribed", 1), expected["outputContent"]["prescribed"][1]),
+        (("outputContent", "warnings", 0), "dizziness"),
+        (("outputContent", "warnings", 1), "nausea, mild"),
+        (("count",), 2),
+    ]
+
+
+@pytest.mark.parametrize("patterns", [PATTERNS, None])
+def test_events_do_not_depend_on_chunking(patterns):
+    expected = parse([DOCUMENT], patterns)
+    assert parse(list(DOCUMENT), patterns) == expected
+    for split in range(1, len(DOCUMENT)):
+        assert parse([DOCUMENT[:split], DOCUMENT[split:]], patterns) == expected, f"split at {split}"
+
+
+def test_incomplete_document_raises():
+    parser = IncrementalJsonParser()
+    parser.feed(DOCUMENT[:len(DOCUMENT) // 2])
+    with pytest.raises(ValueError):
+        parser.result()